@@ -0,0 +1,225 @@
+from collections import OrderedDict
+from functools import wraps
+import inspect
+from threading import Lock
+from time import monotonic
+from typing import Callable, Hashable
+import hashlib
+import os
+import pickle
+import tempfile
+
+from plotly.basedatatypes import BaseFigure
+
+from app.encoding import pack_arrays
+
+__all__ = ['FigureCache']
+
+
+# Turn callback arguments into a hashable key. Lists are kept in order unless `sort_lists` is set, since the order of
+# the selected values changes some figures (trace order and colors)
+def _normalize(value, sort_lists=False) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _normalize(item, sort_lists)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        items = tuple(_normalize(item, sort_lists) for item in value)
+        return tuple(sorted(items, key=repr)) if sort_lists or isinstance(value, set) else items
+    return value
+
+
+# Figures are cached as plain dicts, with their arrays packed: they are cheaper to pickle and send
+def _to_cacheable(value):
+    if isinstance(value, BaseFigure):
+        return pack_arrays(value.to_plotly_json())
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_cacheable(item) for item in value)
+    return value
+
+
+class FigureCache:
+    """
+    Memoization cache for the figure callbacks of the dashboard. Results are keyed on the callback name, its normalized
+    inputs and the dataset version written by the ETL, so a reload of the data invalidates every cached figure. There
+    is an in-process LRU tier, bounded by the pickled size of the results, and an optional on-disk tier shared by every
+    process using the same directory.
+    """
+
+    def __init__(self, version_getter: Callable[[], Hashable] = None, max_memory_bytes=256 * 2 ** 20,
+                 disk_dir: str = None, max_disk_bytes=1024 * 2 ** 20, version_ttl=5.0):
+        """
+        Parameters:
+            version_getter (Callable): Returns the current dataset version (default: no versioning).
+            max_memory_bytes (int): Maximum size of the in-process tier (default: 256 MB).
+            disk_dir (str): Directory of the on-disk tier, None to disable it (default: None).
+            max_disk_bytes (int): Maximum size of the on-disk tier (default: 1 GB).
+            version_ttl (float): Seconds the dataset version is reused before it is read again (default: 5).
+        """
+        self.version_getter = version_getter
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.version_ttl = version_ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = Lock()
+        self._version = None
+        self._version_time = None
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def version(self) -> Hashable:
+        """
+        Get the dataset version, reading it at most once every `version_ttl` seconds. When it changes, the in-process
+        tier is emptied.
+        """
+        if self.version_getter is None:
+            return None
+        now = monotonic()
+        if self._version_time is None or now - self._version_time > self.version_ttl:
+            version = self.version_getter()
+            with self._lock:
+                if version != self._version:
+                    self._memory.clear()
+                    self._memory_bytes = 0
+                self._version, self._version_time = version, now
+        return self._version
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counters of the cache and its current size.
+        """
+        with self._lock:
+            requests = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / requests if requests else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes
+            }
+
+    def clear(self):
+        """
+        Empty both tiers of the cache.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.disk_dir:
+            for filename in os.listdir(self.disk_dir):
+                if filename.endswith('.pkl'):
+                    os.remove(os.path.join(self.disk_dir, filename))
+
+    def get(self, key: Hashable):
+        """
+        Get a cached value, looking first in memory and then on disk.
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return True, self._memory[key][0]
+        data = self._read_disk(key)
+        if data is not None:
+            value = pickle.loads(data)
+            self._set_memory(key, value, len(data))
+            with self._lock:
+                self.disk_hits += 1
+            return True, value
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, key: Hashable, value):
+        """
+        Store a value in both tiers of the cache.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._set_memory(key, value, len(data))
+        self._write_disk(key, data)
+
+    def memoize(self, name: str = None, sort_lists=False, ignore=()):
+        """
+        Decorator caching the results of a callback.
+
+        Parameters:
+            name (str): Name used in the keys (default: the name of the function).
+            sort_lists (bool): Whether the order of list arguments can be ignored (default: False).
+            ignore (tuple): Names of arguments that don't change the result, like progress callbacks or session ids.
+        """
+        def decorator(func):
+            prefix = name or func.__name__
+            signature = inspect.signature(func)
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                arguments = signature.bind(*args, **kwargs).arguments
+                key_arguments = {key: value for key, value in arguments.items() if key not in ignore}
+                key = (prefix, self.version(), _normalize(key_arguments, sort_lists))
+                hit, value = self.get(key)
+                if not hit:
+                    value = _to_cacheable(func(*args, **kwargs))
+                    self.set(key, value)
+                return value
+            return wrapper
+        return decorator
+
+    def _set_memory(self, key, value, size):
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                self._memory_bytes -= self._memory.popitem(last=False)[1][1]
+
+    def _disk_path(self, key) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha256(repr(key).encode()).hexdigest() + '.pkl')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # The access time is used for the LRU eviction of the disk tier
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir or len(data) > self.max_disk_bytes:
+            return
+        # Write to a temporary file first, so other processes never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._disk_path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,116 @@
+from threading import Lock
+import configparser
+import os
+
+from dash import DiskcacheManager
+import diskcache
+
+from app.cache import FigureCache
+from app.governance import QueryGovernor
+from app.graph_layout import GraphLayoutEngine
+from app.search import IdSearch
+from app.stats import StatsService
+from utils.database import connect_to_mongodb, connect_to_mysql_pool
+from utils.metadata import get_dataset_version
+
+__all__ = ['DashboardContext']
+
+
+class DashboardContext:
+    """
+    Everything the callbacks of a dashboard share: database handles, services and caches. Connections and services are
+    created lazily in each process, so a context can be built before a WSGI server forks its workers, and all of them
+    are safe to use from several threads.
+    """
+
+    def __init__(self, mysql_db_name='amz_reviews', mongo_db_name='amz_reviews', config_path='config.ini'):
+        """
+        Parameters:
+            mysql_db_name (str): Name of the MySQL database with the users and items.
+            mongo_db_name (str): Name of the MongoDB database with the reviews.
+            config_path (str): Path of the configuration file (default: 'config.ini').
+        """
+        self.mysql_db_name = mysql_db_name
+        self.mongo_db_name = mongo_db_name
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        # The searches take a connection per thread without waiting for one, so the pool has one for every request
+        # thread of a worker (e.g. `gunicorn --threads 8`) and every warm-up thread
+        self.mysql_pool_size = max(config.getint('Dashboard', 'mysql_pool_size', fallback=8),
+                                   config.getint('Dashboard', 'warm_up_workers', fallback=4))
+        # Local copy of the dataset stats, so a restarted process renders the dashboard before reading the database
+        self.snapshot_path = config.get('Dashboard', 'snapshot_path', fallback='') or None
+        # Whether the default figures are computed before serving, and with how many threads
+        self.warm_up = config.getboolean('Dashboard', 'warm_up', fallback=True)
+        self.warm_up_workers = config.getint('Dashboard', 'warm_up_workers', fallback=4)
+        # Whether the Prometheus metrics are served at /metrics
+        self.metrics = config.getboolean('Dashboard', 'metrics', fallback=True)
+        # Whether responses are compressed when the browser accepts it
+        self.compress = config.getboolean('Dashboard', 'compress', fallback=True)
+        # Cache of the figure callbacks, invalidated when the ETL writes a new dataset version
+        self.figure_cache = FigureCache(version_getter=self.dataset_version,
+                                        max_memory_bytes=config.getint('Cache', 'memory_mb', fallback=256) * 2 ** 20,
+                                        disk_dir=config.get('Cache', 'disk_dir', fallback='') or None,
+                                        max_disk_bytes=config.getint('Cache', 'disk_mb', fallback=1024) * 2 ** 20)
+        # Layouts of the user graph and rendered word clouds, on disk so they outlive the process that computed them:
+        # every background job runs in a new process
+        self.shared_cache = diskcache.Cache(config.get('Cache', 'shared_dir', fallback='.shared_cache'),
+                                            size_limit=config.getint('Cache', 'shared_mb', fallback=512) * 2 ** 20)
+        self.layout_engine = GraphLayoutEngine(store=self.shared_cache)
+        # Queue and results of the background callbacks, on disk so every worker process shares them. Results are
+        # keyed on the callback inputs and the dataset version
+        background_cache = diskcache.Cache(config.get('Dashboard', 'background_dir', fallback='.background_cache'))
+        self.background_manager = DiskcacheManager(background_cache, cache_by=[self.figure_cache.version],
+                                                   expire=config.getint('Dashboard', 'background_expire',
+                                                                        fallback=3600))
+        # Time budgets of the queries of each figure callback (e.g. `fig2_budget_ms`)
+        self.governor = QueryGovernor(
+            default_budget_ms=config.getint('Queries', 'budget_ms', fallback=15000),
+            budgets={key[:-len('_budget_ms')]: config.getint('Queries', key)
+                     for key in (config['Queries'] if config.has_section('Queries') else {})
+                     if key.endswith('_budget_ms')}
+        )
+        self._pid = None
+        self._lock = Lock()
+
+    # (Re)create the per process services after a fork
+    def _ensure_process(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._collection = connect_to_mongodb()[self.mongo_db_name]['reviews']
+            self._stats = StatsService(self._collection, snapshot_path=self.snapshot_path)
+            # Items and users are searched in MySQL, where their ids are the primary key
+            mysql_pool = connect_to_mysql_pool(self.mysql_db_name, pool_size=self.mysql_pool_size)
+            self._item_search = IdSearch(mysql_pool, 'items')
+            self._user_search = IdSearch(mysql_pool, 'users')
+            self._pid = os.getpid()
+
+    @property
+    def collection(self):
+        self._ensure_process()
+        return self._collection
+
+    @property
+    def stats(self) -> StatsService:
+        self._ensure_process()
+        return self._stats
+
+    @property
+    def item_search(self) -> IdSearch:
+        self._ensure_process()
+        return self._item_search
+
+    @property
+    def user_search(self) -> IdSearch:
+        self._ensure_process()
+        return self._user_search
+
+    @property
+    def categories(self) -> list:
+        return self.stats.categories()
+
+    def dataset_version(self):
+        return self.collection.full_name, get_dataset_version(self.collection.database)
@@ -1,34 +1,46 @@
-from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
+from dash import Dash, dcc, html, ctx
+from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
+import plotly.io
 
 import dash_mantine_components as dmc
+from app.context import DashboardContext
 from app.figures import *
-from utils.database import connect_to_mysql, connect_to_mongodb
+from app.metrics import install_metrics, timed_background_callback, timed_callback
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import os
 import random
-
-app = Dash(__name__, external_stylesheets=[dbc.themes.SPACELAB, dbc.icons.BOOTSTRAP],
-           suppress_callback_exceptions=True)
-
-# Connect to MongoDB and MySQL databases
-MONGO_CLIENT = connect_to_mongodb()
-MySQL_CONN = connect_to_mysql()
-cursor = MySQL_CONN.cursor()
-
-# Initialize different categories, item_ids and user_ids
-mongo_collection = None
-categories = []
-item_ids = []
-user_ids = []
-
-def create_cards():
+import uuid
+
+# Number of options loaded at once in the item and user dropdowns
+ITEM_OPTIONS_LIMIT = 50
+USER_OPTIONS_LIMIT = 100
+
+
+# Default selection of the inputs. It is drawn from the dataset version instead of at random, so it only changes when
+# the data does and the default figures can be computed once, before serving, for every viewer
+def default_selection(context) -> dict:
+    categories = context.categories
+    users = context.user_search.search('', limit=USER_OPTIONS_LIMIT)
+    rng = random.Random(str(context.figure_cache.version()))
+    return {
+        'categories': rng.sample(categories, min(2, len(categories))),
+        'category': rng.choice(categories) if categories else None,
+        'users': rng.sample(users, min(15, len(users))),
+        'item_limit': 20,
+        'user_limit': 20
+    }
+
+
+def create_cards(context):
+    counts = context.stats.counts()
     card_users = dbc.Card(
         dbc.CardBody(
             [
                 html.Label([html.I(className="bi bi-people-fill"), html.Strong(" Num. Users: "),
-                           str(len(user_ids))],
+                           str(counts['users'])],
                            className="text-nowrap", style={'font-size': '20px'}),
             ], className="border-start border-success border-5"
         ),
@@ -39,7 +51,7 @@ def create_cards():
         dbc.CardBody(
             [
                 html.Label([html.I(className="bi bi-cart-fill"), html.Strong(" Num. Items: "),
-                           str(len(item_ids))], className="text-nowrap",
+                           str(counts['items'])], className="text-nowrap",
                            style={'font-size': '20px'})
             ], className="border-start border-danger border-5"
         ),
@@ -50,7 +62,7 @@ def create_cards():
         dbc.CardBody(
             [
                 html.Label([html.I(className="bi bi-journal-text"), html.Strong(" Num. Reviews: "),
-                           str(mongo_collection.count_documents({}))],
+                           str(counts['reviews'])],
                            className="text-nowrap", style={'font-size': '20px'})
             ], className="border-start border-primary border-5"
         ),
@@ -60,8 +72,12 @@ def create_cards():
     return [card_users, card_items, card_reviews]
 
 
-def create_layout():
+def create_layout(app, context):
+    categories = context.categories
+    defaults = default_selection(context)
     return html.Div([
+        # Identifies the browser session, used to tell apart the requests of each viewer
+        dcc.Store(id='session-id', storage_type='session', data=uuid.uuid4().hex),
         html.Div([
             html.H1(children='AMZ reviews'),
             html.Label(
@@ -124,7 +140,8 @@ def create_layout():
                         dcc.Input(
                             id='item-limit',
                             type='number',
-                            value=20
+                            value=defaults['item_limit'],
+                            debounce=True
                         ),
                         html.Br(),
                         html.Div([
@@ -195,7 +212,7 @@ def create_layout():
                         dcc.Dropdown(
                             id='categories-dropdown-2',
                             options=[{'label': category, 'value': category} for category in categories],
-                            value=random.sample(categories, 2),
+                            value=defaults['categories'],
                             multi=True,
                             style={'width': '450px'}
                         ),
@@ -217,6 +234,8 @@ def create_layout():
                         html.Br(),
                         html.Br(),
                         html.Div([
+                            # What the figure shows, to send the next change as a patch
+                            dcc.Store(id='fig4-state'),
                             dcc.Graph(id='fig4')
                         ])
                     ], className='box', style={'width': '63%'})
@@ -241,7 +260,8 @@ def create_layout():
                         dcc.Input(
                             id='user-limit',
                             type='number',
-                            value=20
+                            value=defaults['user_limit'],
+                            debounce=True
                         ),
                         html.Br(),
                         html.Div([
@@ -264,9 +284,10 @@ def create_layout():
                         dcc.Dropdown(
                             id='category-dropdown',
                             options=[{'label': category, 'value': category} for category in categories],
-                            value=random.choice(categories),
+                            value=defaults['category'],
                         ),
                         html.Br(),
+                        dbc.Progress(id='fig6-progress', value=0, max=1, style={'height': '4px'}),
                         dcc.Graph(id='fig6')
                     ], className='box', style={'width': '40%'}),
                 ], style={'display': 'flex'}),
@@ -277,8 +298,8 @@ def create_layout():
                         html.Br(),
                         html.Label('This figure displays a graph of user reviews. The data is obtained by querying the '
                                 'collection for all documents with the specified user IDs and retrieving their review '
-                                'information. The review information is then used to generate a graph using the '
-                                'NetworkX library. The graph is displayed using the Plotly library with users and items '
+                                'information. The review information is then used to generate a graph, laid out with a '
+                                'force directed algorithm. The graph is displayed using the Plotly library with users and items '
                                 'represented as nodes and reviews represented as edges. The figure provides a visual '
                                 'representation of the relationships between users, items, and reviews.',
                                 style={'font-size': '12px'}),
@@ -303,6 +324,8 @@ def create_layout():
                                     n_clicks=0),
                         html.Br(),
                         html.Br(),
+                        dbc.Progress(id='fig7-progress', value=0, max=1, style={'height': '4px'}),
+                        dcc.Store(id='fig7-state'),
                         dcc.Graph(id='fig7')
                     ], className='box', style={'width': '97%'}),
                 ], style={'display': 'flex'}),
@@ -324,159 +347,289 @@ def create_layout():
     ])
 
 
-@app.callback(
-    Output('container-id', 'children'),
-    Input('url', 'pathname')
-)
-def update_container(pathname):
-    cards = create_cards()
-    return dbc.Row([dbc.Col(card) for card in cards])
-
-
-@app.callback(
-    Output('fig1', 'figure'),
-    Input('categories-dropdown-1', 'value')
-)
-def update_fig1(categories_):
-    return generate_fig1(mongo_collection, categories_)
-
-
-@app.callback(
-    Output('fig2', 'figure'),
-    Input('item-limit', 'value')
-)
-def update_fig2(limit):
-    return generate_fig2(mongo_collection, limit)
-
-
-prev_search_field = None
-prev_n_clicks = 0
-
-
-@app.callback(
-    [Output('values-dropdown', 'options'),
-     Output('values-dropdown', 'value')],
-    [Input('search-field-dropdown', 'value'),
-     Input('submit-button', 'n_clicks'),
-     Input('input-value', 'value'),
-     Input('values-dropdown', 'value')]
-)
-def update_values_dropdown(search_field, n_clicks, input_value, values):
-    global prev_search_field, prev_n_clicks
-    if search_field == 'item_id':
-        options = item_ids[:50] + [value for value in values if value not in categories]
-        if input_value in item_ids and input_value not in options and n_clicks - prev_n_clicks > 0:
-            options.append(input_value)
-            values.append(input_value)
-    else:
-        options = categories
-
-    options = [{'label': option, 'value': option} for option in options]
-    prev_n_clicks = n_clicks
-
-    if values is None or search_field != prev_search_field:
-        prev_search_field = search_field
-        values = [options[0]['value'], options[1]['value']]
-    return options, values
-
-
-@app.callback(
-    Output('fig3', 'figure'),
-    Input('search-field-dropdown', 'value'),
-    Input('values-dropdown', 'value')
-)
-def update_fig3(search_field, values):
-    return generate_fig3(mongo_collection, search_field, values)
-
-
-@app.callback(
-    [Output('date-range-picker', 'minDate'),
-     Output('date-range-picker', 'maxDate'),
-     Output('date-range-picker', 'value')],
-    Input('categories-dropdown-2', 'value'))
-def update_date_range_picker(categories_):
-    if not categories_:
-        return None, None
-    match = {'category': {'$in': categories_}}
-    min_date = str(mongo_collection.find(match).sort('reviewTime', 1).limit(1)[0]['reviewTime']).rsplit(' ')[0]
-    max_date = str(mongo_collection.find(match).sort('reviewTime', -1).limit(1)[0]['reviewTime']).rsplit(' ')[0]
-    return min_date, max_date, [min_date, max_date]
-
-
-@app.callback(
-    Output('fig4', 'figure'),
-    [Input('categories-dropdown-2', 'value'),
-     Input('date-range-picker', 'value')]
-)
-def update_fig4(categories_, dates):
-    start_date, end_date = dates
-    return generate_fig4(collection=mongo_collection, categories=categories_,
-                         start_date=datetime.strptime(start_date, "%Y-%m-%d"),
-                         end_date=datetime.strptime(end_date, "%Y-%m-%d"))
-
-
-@app.callback(
-    Output('fig5', 'figure'),
-    Input('user-limit', 'value')
-)
-def update_fig5(limit):
-    return generate_fig5(mongo_collection, limit)
-
-
-@app.callback(
-    Output('fig6', 'figure'),
-    Input('category-dropdown', 'value')
-)
-def update_fig6(category):
-    return generate_fig6(mongo_collection, category)
-
-
-prev_n_clicks_2 = 0
-
-
-@app.callback(
-    [Output('users-dropdown', 'options'),
-     Output('users-dropdown', 'value')],
-    [Input('submit-button-2', 'n_clicks'),
-     Input('input-value-2', 'value'),
-     Input('users-dropdown', 'value')]
-)
-def update_users_dropdown(n_clicks, input_value, values):
-    global prev_n_clicks_2
-    options = user_ids[:100]
-    if values is None:
-        options = [{'label': option, 'value': option} for option in options]
-        values = [option['value'] for option in random.sample(options, 15)]
-    else:
-        options += values
-        if input_value in user_ids and input_value not in options and n_clicks - prev_n_clicks_2 > 0:
-            options.append(input_value)
-            values.append(input_value)
-
-        options = [{'label': option, 'value': option} for option in options]
-        prev_n_clicks_2 = n_clicks
-    return options, values
+def register_callbacks(app, context) -> dict:
+    """
+    Register the callbacks of the dashboard.
 
+    Returns:
+        dict: The cached figure functions, by figure name. They take the same arguments as their callbacks.
+    """
+    @app.callback(
+        Output('container-id', 'children'),
+        Input('url', 'pathname')
+    )
+    @timed_callback
+    def update_container(pathname):
+        cards = create_cards(context)
+        return dbc.Row([dbc.Col(card) for card in cards])
+
+    # Figures are computed with the queries governed per session (see `QueryGovernor.scope`), the session id is not
+    # part of the cache keys so every session shares the cached figures
+    @context.figure_cache.memoize(sort_lists=True, ignore=('session_id',))
+    def fig1(categories_, session_id):
+        with context.governor.scope(context.collection, session_id, 'fig1') as collection:
+            return generate_fig1(collection, categories_)
+
+    @app.callback(
+        Output('fig1', 'figure'),
+        Input('categories-dropdown-1', 'value'),
+        State('session-id', 'data')
+    )
+    @timed_callback
+    def update_fig1(categories_, session_id):
+        return fig1(categories_, session_id)
+
+    @context.figure_cache.memoize(ignore=('session_id',))
+    def fig2(limit, session_id):
+        with context.governor.scope(context.collection, session_id, 'fig2') as collection:
+            return generate_fig2(collection, limit)
+
+    @app.callback(
+        Output('fig2', 'figure'),
+        Input('item-limit', 'value'),
+        State('session-id', 'data')
+    )
+    @timed_callback
+    def update_fig2(limit, session_id):
+        return fig2(limit, session_id)
+
+    @app.callback(
+        [Output('values-dropdown', 'options'),
+         Output('values-dropdown', 'value')],
+        [Input('search-field-dropdown', 'value'),
+         Input('submit-button', 'n_clicks'),
+         Input('input-value', 'value'),
+         Input('values-dropdown', 'value'),
+         Input('values-dropdown', 'search_value')]
+    )
+    @timed_callback
+    def update_values_dropdown(search_field, n_clicks, input_value, values, search_value):
+        # The input that fired the callback replaces the previous values kept between requests, so the callback holds no
+        # state and any worker can serve it
+        triggered_id = ctx.triggered_id
+        categories = context.categories
+        if search_field == 'item_id':
+            # Items matching what is being typed, plus the ones already selected
+            options = context.item_search.search(search_value or '', limit=ITEM_OPTIONS_LIMIT)
+            options += [value for value in values or [] if value not in categories and value not in options]
+            if input_value and input_value not in options and triggered_id == 'submit-button' \
+                    and context.item_search.exists(input_value):
+                options.append(input_value)
+                values.append(input_value)
+        else:
+            options = categories
 
-@app.callback(
-    Output('fig7', 'figure'),
-    Input('users-dropdown', 'value'),
-)
-def update_fig7(user_ids_):
-    return generate_fig7(mongo_collection, user_ids_)
+        options = [{'label': option, 'value': option} for option in options]
 
+        if values is None or triggered_id == 'search-field-dropdown':
+            values = [options[0]['value'], options[1]['value']]
+        return options, values
 
-def launch_app(mysql_db_name='amz_reviews', mongo_db_name='amz_reviews'):
-    global mongo_collection, categories, item_ids, user_ids
+    @context.figure_cache.memoize(sort_lists=True, ignore=('session_id',))
+    def fig3(search_field, values, session_id):
+        with context.governor.scope(context.collection, session_id, 'fig3') as collection:
+            return generate_fig3(collection, search_field, values)
 
-    mongo_collection = MONGO_CLIENT[mongo_db_name]['reviews']
-    cursor.execute(f'USE {mysql_db_name}')
+    @app.callback(
+        Output('fig3', 'figure'),
+        Input('search-field-dropdown', 'value'),
+        Input('values-dropdown', 'value'),
+        State('session-id', 'data')
+    )
+    @timed_callback
+    def update_fig3(search_field, values, session_id):
+        return fig3(search_field, values, session_id)
+
+    @app.callback(
+        [Output('date-range-picker', 'minDate'),
+         Output('date-range-picker', 'maxDate'),
+         Output('date-range-picker', 'value')],
+        Input('categories-dropdown-2', 'value'))
+    @timed_callback
+    def update_date_range_picker(categories_):
+        # The date range of every category is precomputed by the ETL
+        min_date, max_date = context.stats.date_bounds(categories_ or [])
+        if min_date is None:
+            return None, None, None
+        min_date, max_date = min_date.strftime('%Y-%m-%d'), max_date.strftime('%Y-%m-%d')
+        return min_date, max_date, [min_date, max_date]
+
+    @context.figure_cache.memoize(ignore=('session_id',))
+    def fig4(categories_, dates, session_id):
+        start_date, end_date = dates
+        with context.governor.scope(context.collection, session_id, 'fig4') as collection:
+            return generate_fig4(collection=collection, categories=categories_,
+                                 start_date=datetime.strptime(start_date, "%Y-%m-%d"),
+                                 end_date=datetime.strptime(end_date, "%Y-%m-%d"))
+
+    # Adding a category only sends its trace and the new total
+    @app.callback(
+        [Output('fig4', 'figure'),
+         Output('fig4-state', 'data')],
+        [Input('categories-dropdown-2', 'value'),
+         Input('date-range-picker', 'value')],
+        [State('session-id', 'data'),
+         State('fig4-state', 'data')]
+    )
+    @timed_callback
+    def update_fig4(categories_, dates, session_id, state):
+        figure = fig4(categories_, dates, session_id)
+        patch = patch_fig4(figure, categories_, dates, state)
+        return figure if patch is None else patch, fig4_state(figure, categories_, dates)
+
+    @context.figure_cache.memoize(ignore=('session_id',))
+    def fig5(limit, session_id):
+        with context.governor.scope(context.collection, session_id, 'fig5') as collection:
+            return generate_fig5(collection, limit)
+
+    @app.callback(
+        Output('fig5', 'figure'),
+        Input('user-limit', 'value'),
+        State('session-id', 'data')
+    )
+    @timed_callback
+    def update_fig5(limit, session_id):
+        return fig5(limit, session_id)
+
+    # The word cloud and the user graph are slow to build, so they run as background jobs: the request returns at once,
+    # the browser polls the progress, a newer selection cancels the running job and finished results are shared by every
+    # viewer asking for the same inputs. Each job runs in a new process, so what it computes is only reused through the
+    # caches on disk: the results of the manager, the disk tier of the figure cache and the shared cache of the context.
+    # Their jobs are timed in the job process and the timings sent to the serving processes through the shared cache
+    metrics_store = context.shared_cache if context.metrics else None
+    @context.figure_cache.memoize(ignore=('session_id', 'progress'))
+    def fig6(category, session_id, progress=None):
+        with context.governor.scope(context.collection, session_id, 'fig6') as collection:
+            return generate_fig6(collection, category, progress=progress, store=context.shared_cache)
+
+    @app.callback(
+        Output('fig6', 'figure'),
+        Input('category-dropdown', 'value'),
+        State('session-id', 'data'),
+        background=True,
+        manager=context.background_manager,
+        progress=[Output('fig6-progress', 'value'), Output('fig6-progress', 'max')],
+        cache_args_to_ignore=[1]
+    )
+    @timed_background_callback(metrics_store, 'fig6.figure')
+    def update_fig6(set_progress, category, session_id):
+        return fig6(category, session_id, progress=lambda done, total: set_progress((done, total)))
+
+    @app.callback(
+        [Output('users-dropdown', 'options'),
+         Output('users-dropdown', 'value')],
+        [Input('submit-button-2', 'n_clicks'),
+         Input('input-value-2', 'value'),
+         Input('users-dropdown', 'value'),
+         Input('users-dropdown', 'search_value')]
+    )
+    @timed_callback
+    def update_users_dropdown(n_clicks, input_value, values, search_value):
+        # Users matching what is being typed
+        options = context.user_search.search(search_value or '', limit=USER_OPTIONS_LIMIT)
+        if values is None:
+            values = default_selection(context)['users']
+            options = [{'label': option, 'value': option} for option in options]
+        else:
+            options += [value for value in values if value not in options]
+            if input_value and input_value not in options and ctx.triggered_id == 'submit-button-2' \
+                    and context.user_search.exists(input_value):
+                options.append(input_value)
+                values.append(input_value)
+
+            options = [{'label': option, 'value': option} for option in options]
+        return options, values
+
+    @context.figure_cache.memoize(sort_lists=True, ignore=('session_id', 'progress'))
+    def fig7(user_ids_, session_id, progress=None):
+        with context.governor.scope(context.collection, session_id, 'fig7') as collection:
+            return generate_fig7(collection, user_ids_, progress=progress, layout_engine=context.layout_engine)
+
+    # Adding a few users keeps the graph drawn in the browser and only sends the new nodes and edges
+    @app.callback(
+        [Output('fig7', 'figure'),
+         Output('fig7-state', 'data')],
+        Input('users-dropdown', 'value'),
+        [State('session-id', 'data'),
+         State('fig7-state', 'data')],
+        background=True,
+        manager=context.background_manager,
+        progress=[Output('fig7-progress', 'value'), Output('fig7-progress', 'max')],
+        cache_args_to_ignore=[1]
+    )
+    @timed_background_callback(metrics_store, 'fig7.figure')
+    def update_fig7(set_progress, user_ids_, session_id, state):
+        progress = lambda done, total: set_progress((done, total))
+        if can_patch_fig7(state, user_ids_):
+            with context.governor.scope(context.collection, session_id, 'fig7') as collection:
+                return generate_fig7_patch(collection, state, user_ids_, progress=progress)
+        figure = fig7(user_ids_, session_id, progress=progress)
+        return figure, fig7_state(figure, user_ids_)
+
+    return {'fig1': fig1, 'fig2': fig2, 'fig3': fig3, 'fig4': fig4, 'fig5': fig5, 'fig6': fig6, 'fig7': fig7}
+
+
+def warm_up(context, figures: dict, workers=4):
+    """
+    Compute the figures of the default selection in parallel, so they are cached before the first viewer arrives.
+
+    Parameters:
+        context (DashboardContext): The context of the dashboard.
+        figures (dict): The figure functions returned by `register_callbacks`.
+        workers (int): Number of figures computed at once (default: 4).
+    """
+    defaults = default_selection(context)
+    categories = context.categories
+    min_date, max_date = context.stats.date_bounds(defaults['categories'])
+    # Same arguments the callbacks receive on the first page load
+    jobs = {
+        'fig1': (categories,),
+        'fig2': (defaults['item_limit'],),
+        'fig3': ('category', categories[:2]),
+        'fig5': (defaults['user_limit'],),
+        'fig6': (defaults['category'],),
+        'fig7': (defaults['users'],)
+    }
+    if min_date is not None:
+        jobs['fig4'] = (defaults['categories'], [min_date.strftime('%Y-%m-%d'), max_date.strftime('%Y-%m-%d')])
+    # A session of its own, so the warm-up of other processes is not cancelled
+    session_id = f'warm-up-{os.getpid()}'
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(figures[name], *args, session_id) for name, args in jobs.items()}
+    for name, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            # A figure that fails is computed by its callback later, as if there was no warm-up
+            print(f"Could not warm up {name}: {e!r}")
+
+
+def create_app(mysql_db_name='amz_reviews', mongo_db_name='amz_reviews') -> Dash:
+    """
+    Create the dashboard for the given databases. The returned app keeps no per-viewer state in the process, so its
+    Flask server (`app.server`) can be served by a WSGI server with several worker processes and threads.
+
+    Parameters:
+        mysql_db_name (str): Name of the MySQL database with the users and items (default: 'amz_reviews').
+        mongo_db_name (str): Name of the MongoDB database with the reviews (default: 'amz_reviews').
+    """
+    # Callback outputs are serialized with orjson, much faster than the standard encoder on large figures
+    plotly.io.json.config.default_engine = 'orjson'
+    context = DashboardContext(mysql_db_name, mongo_db_name)
+    # Responses are gzip/brotli compressed when the browser accepts it
+    app = Dash(__name__, external_stylesheets=[dbc.themes.SPACELAB, dbc.icons.BOOTSTRAP],
+               suppress_callback_exceptions=True, compress=context.compress)
+    # The layout is built on every page load
+    app.layout = lambda: create_layout(app, context)
+    figures = register_callbacks(app, context)
+    if context.metrics:
+        install_metrics(app, context)
+    if context.warm_up:
+        warm_up(context, figures, workers=context.warm_up_workers)
+    return app
 
-    # Select different categories, item_ids and user_ids
-    categories = mongo_collection.distinct('category')
-    item_ids = mongo_collection.distinct('item_id')
-    user_ids = mongo_collection.distinct('reviewer_id')
 
-    # Run app
-    app.layout = create_layout()
+def launch_app(mysql_db_name='amz_reviews', mongo_db_name='amz_reviews'):
+    # Run app on the development server, see `wsgi.py` to serve it with several processes
+    app = create_app(mysql_db_name, mongo_db_name)
     app.run(debug=False)
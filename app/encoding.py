@@ -0,0 +1,91 @@
+import base64
+
+from dash import Dash
+from plotly.offline import get_plotlyjs_version
+import numpy as np
+
+__all__ = ['pack_arrays', 'unpack_array', 'typed_arrays_supported']
+
+# Shortest array sent as a typed array, shorter ones are as cheap as plain JSON
+TYPED_ARRAY_MIN_LENGTH = 64
+
+# Integer types of the typed arrays understood by plotly.js, from the most compact
+INTEGER_DTYPES = ('u1', 'i1', 'u2', 'i2', 'u4', 'i4')
+
+
+# First plotly.js version reading typed arrays
+TYPED_ARRAYS_PLOTLYJS_VERSION = (2, 28)
+
+
+def typed_arrays_supported() -> bool:
+    """
+    Whether the plotly.js served with the dashboard reads typed arrays. Dash 2.13 and later serve the plotly.js of the
+    plotly package (plotly 5.18 and later bundle 2.28 or newer); older versions serve their own, which does not.
+    """
+    if not hasattr(Dash, '_setup_plotlyjs'):
+        return False
+    version = tuple(int(part) for part in get_plotlyjs_version().split('.')[:2])
+    return version >= TYPED_ARRAYS_PLOTLYJS_VERSION
+
+
+# Checked once, the installed packages don't change while the dashboard runs
+TYPED_ARRAYS = typed_arrays_supported()
+
+
+# Encode a numeric 1D array as a plotly.js typed array ({'dtype', 'bdata'}), None if it is not one
+def _typed_array(value):
+    if not isinstance(value, (list, tuple, np.ndarray)) or len(value) < TYPED_ARRAY_MIN_LENGTH:
+        return None
+    array = np.asarray(value)
+    if array.ndim != 1:
+        return None
+    if array.dtype.kind == 'O':
+        # Numbers with missing values (None), sent as NaN gaps
+        if not all(item is None or isinstance(item, (int, float)) and not isinstance(item, bool) for item in array):
+            return None
+        array = array.astype(float)
+    if array.dtype.kind in 'iu':
+        low, high = array.min(), array.max()
+        dtype = next((dtype for dtype in INTEGER_DTYPES
+                      if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max), 'f8')
+    elif array.dtype.kind == 'f':
+        dtype = 'f8'
+    else:
+        return None
+    # plotly.js reads the buffers as little endian
+    data = array.astype(np.dtype(dtype).newbyteorder('<')).tobytes()
+    return {'dtype': dtype, 'bdata': base64.b64encode(data).decode('ascii')}
+
+
+def _pack(value):
+    if isinstance(value, dict):
+        return {key: _pack(item) for key, item in value.items()}
+    typed_array = _typed_array(value)
+    if typed_array is not None:
+        return typed_array
+    if isinstance(value, (list, tuple)):
+        return [_pack(item) for item in value]
+    return value
+
+
+def pack_arrays(figure: dict) -> dict:
+    """
+    Replace the numeric arrays of the traces of a figure with plotly.js typed arrays (base64 encoded buffers), which
+    are several times smaller than JSON numbers and much faster to encode and parse. The layout is left as is, and so
+    is the whole figure when the plotly.js served does not read typed arrays (see `typed_arrays_supported`).
+
+    Parameters:
+        figure (dict): The figure, as returned by `to_plotly_json`.
+    """
+    if not TYPED_ARRAYS:
+        return figure
+    return {**figure, 'data': [_pack(trace) for trace in figure.get('data', [])]}
+
+
+def unpack_array(value) -> np.ndarray:
+    """
+    Get the values of an array of a packed figure, whether it was sent as a typed array or as a list.
+    """
+    if isinstance(value, dict) and 'bdata' in value:
+        return np.frombuffer(base64.b64decode(value['bdata']), dtype=np.dtype(value['dtype']).newbyteorder('<'))
+    return np.asarray(value, dtype=float)
@@ -1,15 +1,36 @@
+from dash import Patch
 import plotly.express as px
 import plotly.graph_objs as go
 from PIL import Image
 
 from wordcloud import WordCloud, ImageColorGenerator
-from typing import Collection
+from typing import Callable, Collection
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+from threading import Lock
 import numpy as np
 
-import networkx as nx
+from app.encoding import pack_arrays, unpack_array
+from app.graph_layout import GraphLayoutEngine
+from utils.metadata import TERM_FREQUENCIES_COLLECTION, get_dataset_version
 
 __all__ = ['generate_fig1', 'generate_fig2', 'generate_fig3', 'generate_fig4', 'generate_fig5', 'generate_fig6',
-           'generate_fig7']
+           'generate_fig7', 'fig4_state', 'patch_fig4', 'fig7_state', 'can_patch_fig7', 'generate_fig7_patch']
+
+# Layouts of the user graph (fig7) of the callbacks not given an engine of their own
+LAYOUT_ENGINE = GraphLayoutEngine()
+
+# Figures with more points than this are drawn with WebGL, SVG gets slow beyond a few thousand points
+WEBGL_POINT_THRESHOLD = 5000
+
+# Most users added at once to the graph (fig7) with a patch, instead of drawing it again
+FIG7_PATCH_MAX_USERS = 5
+
+
+# Scatter trace class for a figure with the given number of points
+def _scatter_type(num_points: int):
+    return go.Scattergl if num_points > WEBGL_POINT_THRESHOLD else go.Scatter
 
 
 def generate_fig1(collection, categories: Collection[str]):
@@ -162,7 +183,47 @@ def generate_fig3(collection, search_field: str, values: Collection[str]):
     return fig
 
 
-def generate_fig4(collection, categories, start_date=None, end_date=None):
+# Bucket sizes (MongoDB `$dateTrunc` units) and the longest date span each one is used for
+FIG4_BUCKETS = (('day', timedelta(days=180)), ('week', timedelta(days=3 * 365)), ('month', None))
+
+
+# Choose the coarsest bucket needed to keep the number of points proportional to the selected date range
+def _choose_bucket(start_date=None, end_date=None) -> str:
+    if start_date is None or end_date is None:
+        return FIG4_BUCKETS[-1][0]
+    span = end_date - start_date
+    for unit, max_span in FIG4_BUCKETS:
+        if max_span is None or span <= max_span:
+            return unit
+    return FIG4_BUCKETS[-1][0]
+
+
+# Largest-Triangle-Three-Buckets downsampling: returns the indices of the points to keep
+def _lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # First and last points are always kept, the rest are split in `threshold - 2` buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average point of the next bucket (the last point for the final bucket)
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        # Keep the point forming the largest triangle with the previous selected point and the next average
+        areas = np.abs((x[prev] - avg_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (avg_y - y[prev]))
+        prev = lo + int(np.argmax(areas))
+        selected[i + 1] = prev
+    return selected
+
+
+def generate_fig4(collection, categories, start_date=None, end_date=None, max_points: int = 1000):
     match = {'category': {'$in': categories}}
     if start_date:
         match['reviewTime'] = {'$gte': start_date}
@@ -171,40 +232,72 @@ def generate_fig4(collection, categories, start_date=None, end_date=None):
             match['reviewTime']['$lte'] = end_date
         else:
             match['reviewTime'] = {'$lte': end_date}
+    bucket = _choose_bucket(start_date, end_date)
+    # Count reviews per bucket and category on the server, so only one document per bucket is transferred
     response = list(collection.aggregate([
         {'$match': match},
-        {'$group': {'_id': {'date': '$reviewTime', 'category': '$category'}, 'review_count': {'$sum': 1}}},
-        {'$sort': {'_id.date': 1}}
+        {'$group': {'_id': {'date': {'$dateTrunc': {'date': '$reviewTime', 'unit': bucket}},
+                            'category': '$category'},
+                    'review_count': {'$sum': 1}}},
+        {'$project': {'_id': 0, 'date': '$_id.date', 'category': '$_id.category', 'review_count': 1}}
     ]))
-    dates = []
-    num_reviews = {category: [] for category in categories}
-    num_reviews['Total'] = []
-    reviews_cumulative = {category: 0 for category in categories}
-    reviews_cumulative['Total'] = 0
-    for data in response:
-        date_category, reviews = data.values()
-        date, category = date_category.values()
-        reviews_cumulative[category] += reviews
-        reviews_cumulative['Total'] += reviews
-        if date not in dates:
-            dates.append(date)
-            for cat in categories:
-                num_reviews[cat].append(reviews_cumulative[cat])
-            num_reviews['Total'].append(reviews_cumulative['Total'])
+
+    # Build a dense (dates x categories) matrix and compute the cumulative series with a prefix sum
+    dates = np.array(sorted({data['date'] for data in response}), dtype='datetime64[ms]')
+    category_index = {category: i for i, category in enumerate(categories)}
+    counts = np.zeros((len(dates), len(categories)), dtype=np.int64)
+    if response:
+        rows = np.searchsorted(dates, np.array([data['date'] for data in response], dtype='datetime64[ms]'))
+        cols = np.array([category_index[data['category']] for data in response])
+        np.add.at(counts, (rows, cols), [data['review_count'] for data in response])
+    cumulative = np.cumsum(counts, axis=0)
+    num_reviews = {category: cumulative[:, i] for category, i in category_index.items()}
+    num_reviews['Total'] = cumulative.sum(axis=1)
+
+    # Downsample every series to the pixel budget before sending it to the browser
+    def trace_data(category):
+        keep = _lttb(dates.astype(np.int64), num_reviews[category], max_points)
+        return dates[keep], num_reviews[category][keep]
 
     fig = go.Figure()
     colors = ['#883000', '#CB5C0D', '#FD6A02', '#EF820D', '#FDA50F', '#FFBF00', '#F8DE7E', '#FFED83']
-    if len(categories) > 1:
-        for i, category in enumerate(categories + ['Total']):
-            fig.add_trace(
-                go.Scatter(x=dates, y=num_reviews[category], name=category, line=dict(color=colors[i % len(colors)])))
-    else:
-        fig.add_trace(go.Scatter(x=dates, y=num_reviews[categories[0]], name=categories[0], line=dict(color=colors[0])))
+    names = categories + ['Total'] if len(categories) > 1 else categories[:1]
+    series = [trace_data(name) for name in names]
+    scatter = _scatter_type(sum(len(x) for x, _ in series))
+    for i, (name, (x, y)) in enumerate(zip(names, series)):
+        fig.add_trace(scatter(x=x, y=y, name=name, line=dict(color=colors[i % len(colors)])))
     fig.update_xaxes(title='Date')
     fig.update_yaxes(title='Number of reviews')
     return fig
 
 
+def fig4_state(figure: dict, categories, dates) -> dict:
+    """
+    Describe the cumulative reviews figure shown in the browser, so the next change can be sent as a patch.
+    """
+    return {'categories': categories, 'dates': dates, 'type': figure['data'][0].get('type') if figure['data'] else None}
+
+
+def patch_fig4(figure: dict, categories, dates, state: dict):
+    """
+    Get the patch turning the figure described by `state` into `figure`, when a category was added at the end of the
+    selection and the dates did not change: only the trace of that category and the total are sent. Returns None for
+    any other change.
+    """
+    if not state or state['dates'] != dates or len(state['categories']) < 2 \
+            or list(categories[:-1]) != list(state['categories']):
+        return None
+    # The traces of the browser can't be reused if the figure switched between SVG and WebGL
+    if any(trace.get('type') != state['type'] for trace in figure['data']):
+        return None
+    num_categories = len(state['categories'])
+    patch = Patch()
+    # The trace of the new category takes the place of the previous total, and the new total goes last
+    patch['data'][num_categories] = figure['data'][num_categories]
+    patch['data'].append(figure['data'][-1])
+    return patch
+
+
 def generate_fig5(collection, limit=None):
     if limit is not None:
         aggregation_pipeline_1 = [
@@ -263,58 +356,126 @@ def generate_fig5(collection, limit=None):
     return fig
 
 
-def generate_fig6(collection, category: str):
-    response = list(collection.find(
-        {'category': category},
-        {'summary': 1, '_id': 0}
-    ))
-    total_words = [data.get('summary') for data in response]
-    wc_text = ' '.join(total_words)
+# Number of rendered word clouds kept in the memory of each process
+WORDCLOUD_CACHE_SIZE = 32
+
+_wordcloud_images = OrderedDict()
+_wordcloud_images_lock = Lock()
+
+
+# Rendered word cloud, from this process or from the cache on disk shared by every process (`store`)
+def _cached_wordcloud(key, store=None):
+    with _wordcloud_images_lock:
+        image = _wordcloud_images.get(key)
+        if image is not None:
+            _wordcloud_images.move_to_end(key)
+            return image
+    image = store.get(key) if store is not None else None
+    if image is not None:
+        _cache_wordcloud(key, image)
+    return image
+
+
+def _cache_wordcloud(key, image: np.ndarray, store=None):
+    with _wordcloud_images_lock:
+        _wordcloud_images[key] = image
+        while len(_wordcloud_images) > WORDCLOUD_CACHE_SIZE:
+            _wordcloud_images.popitem(last=False)
+    if store is not None:
+        store.set(key, image)
+
+
+# The mask only depends on `amazon.png`, so it is decoded once per process
+@lru_cache(maxsize=1)
+def _wordcloud_mask():
     shopping_mask = np.array(Image.open('amazon.png'))
-    image_colors = ImageColorGenerator(shopping_mask)
+    return shopping_mask, ImageColorGenerator(shopping_mask)
+
+
+# Get the term frequencies of a category from the table built by the ETL
+def _term_frequencies(collection, category: str):
+    document = collection.database[TERM_FREQUENCIES_COLLECTION].find_one({'_id': category})
+    if document is not None:
+        return dict(document['frequencies'])
+    # Databases loaded before the table existed: tokenize the summaries here
+    response = collection.find({'category': category}, {'summary': 1, '_id': 0})
+    wc_text = ' '.join(data.get('summary') or '' for data in response)
+    return WordCloud(min_word_length=3).process_text(wc_text)
+
+
+def _render_wordcloud(collection, category: str) -> np.ndarray:
+    shopping_mask, image_colors = _wordcloud_mask()
     wc = WordCloud(background_color="white", max_words=150, mask=shopping_mask,
                    max_font_size=500, min_word_length=3, random_state=42)
-    wc.generate(wc_text)
-    fig6 = px.imshow(wc.recolor(color_func=image_colors))
+    wc.generate_from_frequencies(_term_frequencies(collection, category))
+    return wc.recolor(color_func=image_colors).to_array()
+
+
+def generate_fig6(collection, category: str, progress: Callable[[int, int], None] = None, store=None):
+    # `progress(done, total)` is called as the figure is built. Rendered images are cached per category and dataset
+    # version, in this process and in `store` (a diskcache.Cache) if given, which outlives the process
+    progress = progress or (lambda done, total: None)
+    progress(0, 3)
+    key = ('wordcloud', collection.full_name, category, get_dataset_version(collection.database))
+    image = _cached_wordcloud(key, store)
+    progress(1, 3)
+    if image is None:
+        image = _render_wordcloud(collection, category)
+        _cache_wordcloud(key, image, store)
+    progress(2, 3)
+    # Sent as a PNG instead of a nested list of pixel values
+    fig6 = px.imshow(image, binary_string=True)
     fig6.update_layout(
         height=400
     )
     fig6.update_xaxes(visible=False)
     fig6.update_yaxes(visible=False)
+    progress(3, 3)
     return fig6
 
 
-def generate_fig7(collection, user_ids: Collection[str]):
-    G = nx.Graph()
-    for user_id in user_ids:
-        user_reviews = collection.find({'reviewer_id': user_id})
-        for review in user_reviews:
-            G.add_node(review['reviewer_id'], type='user')
-            G.add_node(review['item_id'], type='item')
-            G.add_edge(review['reviewer_id'], review['item_id'], type='review')
-    pos = nx.spring_layout(G)
-    edge_trace = go.Scatter(
-        x=[],
-        y=[],
+# Reviews of a set of users, as (reviewer ids, item ids)
+def _user_reviews(collection, user_ids: Collection[str]):
+    # Fetch the reviews of every selected user at once, only with the fields needed to build the graph
+    response = list(collection.find(
+        {'reviewer_id': {'$in': list(user_ids or [])}},
+        {'reviewer_id': 1, 'item_id': 1, '_id': 0}
+    ))
+    return [review['reviewer_id'] for review in response], [review['item_id'] for review in response]
+
+
+# Line trace with every edge of the user graph, with a gap (NaN) after every segment
+def _edge_trace(scatter, coords, edges):
+    gaps = np.full(len(edges), np.nan)
+    return scatter(
+        x=np.column_stack([coords[edges[:, 0], 0], coords[edges[:, 1], 0], gaps]).ravel(),
+        y=np.column_stack([coords[edges[:, 0], 1], coords[edges[:, 1], 1], gaps]).ravel(),
         line=dict(width=0.5, color='#888'),
         hoverinfo='none',
         mode='lines')
-    for edge in G.edges():
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edge_trace['x'] += tuple([x0, x1, None])
-        edge_trace['y'] += tuple([y0, y1, None])
-    node_trace = go.Scatter(
-        x=[],
-        y=[],
-        text=[],
+
+
+# Marker trace with nodes of the user graph. Users are colored by their number of reviews, within `color_range`
+def _node_trace(scatter, nodes, is_user, degree, coords, color_range, showscale=True):
+    colors = degree.astype(object)
+    colors[~is_user] = '#ff9900'
+    node_text = [f"{'User' if user else 'Item'} Id: {node}<br>Reviews: {num_reviews}"
+                 for node, user, num_reviews in zip(nodes, is_user, degree)]
+    return scatter(
+        x=coords[:, 0],
+        y=coords[:, 1],
+        text=node_text,
+        # Node ids and number of reviews, to patch the figure later
+        customdata=[[node, int(num_reviews)] for node, num_reviews in zip(nodes, degree)],
         mode='markers',
         hoverinfo='text',
         marker=dict(
-            showscale=True,
+            showscale=showscale,
             colorscale='Greys',
             reversescale=True,
-            color=[],
+            color=colors,
+            cmin=color_range[0],
+            cmax=color_range[1],
             size=10,
             colorbar=dict(
                 thickness=15,
@@ -323,23 +484,36 @@ def generate_fig7(collection, user_ids: Collection[str]):
                 titleside='right'
             ),
             line=dict(width=2)))
-    for node in G.nodes():
-        x, y = pos[node]
-        node_trace['x'] += tuple([x])
-        node_trace['y'] += tuple([y])
-        if G.nodes[node]['type'] == 'item':
-            node_trace['marker']['color'] += tuple(['#ff9900'])
-        else:
-            num_reviews = len(G.adj[node])
-            node_trace['marker']['color'] += tuple([num_reviews])
-    for node, adjacencies in enumerate(G.adjacency()):
-        if G.nodes[adjacencies[0]]['type'] == 'user':
-            node_info = 'User Id: ' + str(adjacencies[0]) + '<br>Reviews: ' + str(len(adjacencies[1]))
-        else:
-            node_info = 'Item Id: ' + str(adjacencies[0]) + '<br>Reviews: ' + str(len(adjacencies[1]))
-        node_trace['text'] += tuple([node_info])
+
+
+def generate_fig7(collection, user_ids: Collection[str], progress: Callable[[int, int], None] = None,
+                  layout_engine: GraphLayoutEngine = None):
+    # `progress(done, total)` is called as the figure is built. The layout is computed by `layout_engine` (default: the
+    # one of the process)
+    progress = progress or (lambda done, total: None)
+    progress(0, 3)
+    reviewers, items = _user_reviews(collection, user_ids)
+
+    # Users first, then items, both in order of appearance
+    users = list(dict.fromkeys(reviewers))
+    nodes = users + [item for item in dict.fromkeys(items)]
+    node_index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(node_index[reviewer], node_index[item]) for reviewer, item in zip(reviewers, items)],
+                     dtype=np.int64).reshape(-1, 2)
+    # A user reviewing the same item twice is still a single edge
+    edges = np.unique(edges, axis=0)
+    degree = np.bincount(edges.ravel(), minlength=len(nodes))
+    is_user = np.arange(len(nodes)) < len(users)
+
+    progress(1, 3)
+    coords = (layout_engine or LAYOUT_ENGINE).layout(nodes, edges, version=get_dataset_version(collection.database))
+    progress(2, 3)
+
+    color_range = (int(degree[is_user].min()), int(degree[is_user].max())) if users else (0, 1)
+    scatter = _scatter_type(3 * len(edges) + len(nodes))
     fig = go.Figure(
-        data=[edge_trace, node_trace],
+        data=[_edge_trace(scatter, coords, edges),
+              _node_trace(scatter, nodes, is_user, degree, coords, color_range)],
         layout=go.Layout(
             height=800,
             titlefont=dict(size=16),
@@ -350,4 +524,121 @@ def generate_fig7(collection, user_ids: Collection[str]):
             yaxis=dict(showgrid=False, zeroline=False, showticklabels=False)
         )
     )
+    progress(3, 3)
     return fig
+
+
+def fig7_state(figure: dict, user_ids: Collection[str]) -> dict:
+    """
+    Describe the user graph shown in the browser: its users and, for every node, its position and number of reviews,
+    so users can be added to it later with a patch.
+
+    Parameters:
+        figure (dict): The figure, as built by `generate_fig7`.
+        user_ids (Collection): The selected users.
+    """
+    node_trace = figure['data'][1]
+    customdata = node_trace.get('customdata') or []
+    return {
+        'users': list(user_ids or []),
+        'nodes': [node for node, _ in customdata],
+        'degree': [num_reviews for _, num_reviews in customdata],
+        'x': unpack_array(node_trace['x']).round(6).tolist() if customdata else [],
+        'y': unpack_array(node_trace['y']).round(6).tolist() if customdata else [],
+        # Number of nodes of each node trace (the odd traces, each after its edges)
+        'sizes': [len(customdata)],
+        'color_range': [node_trace['marker']['cmin'], node_trace['marker']['cmax']],
+        'type': node_trace.get('type', 'scatter')
+    }
+
+
+def can_patch_fig7(state: dict, user_ids: Collection[str]) -> bool:
+    """
+    Whether the user graph described by `state` can be turned into the graph of `user_ids` with a patch: the selection
+    only added a few users to it.
+    """
+    if not state or not state['nodes'] or not user_ids:
+        return False
+    previous = set(state['users'])
+    added = [user for user in user_ids if user not in previous]
+    return previous.issubset(user_ids) and 0 < len(added) <= FIG7_PATCH_MAX_USERS
+
+
+def generate_fig7_patch(collection, state: dict, user_ids: Collection[str],
+                        progress: Callable[[int, int], None] = None):
+    """
+    Add users to the user graph shown in the browser. The nodes already drawn keep their position, the new users and
+    items are laid out around them and sent as a new pair of edge and node traces; only the review counts and color
+    range of the existing nodes are updated.
+
+    Parameters:
+        collection (Collection): The MongoDB reviews collection.
+        state (dict): The state of the figure in the browser (see `fig7_state`).
+        user_ids (Collection): The selected users, those of `state` plus the new ones.
+        progress (Callable): Called as `progress(done, total)` as the patch is built (default: None).
+
+    Returns:
+        tuple: (Patch of the figure, Patch of the state)
+    """
+    progress = progress or (lambda done, total: None)
+    progress(0, 3)
+    previous = set(state['users'])
+    reviewers, items = _user_reviews(collection, [user for user in user_ids if user not in previous])
+    known_index = {node: i for i, node in enumerate(state['nodes'])}
+
+    # Local graph: the new users and items, then the drawn items they are joined to
+    users = list(dict.fromkeys(reviewers))
+    new_nodes = users + [item for item in dict.fromkeys(items) if item not in known_index]
+    neighbours = [item for item in dict.fromkeys(items) if item in known_index]
+    nodes = new_nodes + neighbours
+    node_index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(node_index[reviewer], node_index[item]) for reviewer, item in zip(reviewers, items)],
+                     dtype=np.int64).reshape(-1, 2)
+    edges = np.unique(edges, axis=0)
+    degree = np.bincount(edges.ravel(), minlength=len(nodes))
+    is_user = np.arange(len(nodes)) < len(users)
+    fixed = np.arange(len(nodes)) >= len(new_nodes)
+    positions = np.zeros((len(nodes), 2))
+    for i, node in enumerate(neighbours, start=len(new_nodes)):
+        positions[i] = state['x'][known_index[node]], state['y'][known_index[node]]
+
+    progress(1, 3)
+    coords = LAYOUT_ENGINE.extend(nodes, edges, positions, fixed)
+    progress(2, 3)
+
+    figure_patch, state_patch = Patch(), Patch()
+    # Drawn users keep their number of reviews, so the color range only grows with the new users
+    color_range = list(state['color_range'])
+    if users:
+        color_range = [min(color_range[0], int(degree[is_user].min())), max(color_range[1], int(degree[is_user].max()))]
+    if color_range != state['color_range']:
+        for trace in range(len(state['sizes'])):
+            figure_patch['data'][2 * trace + 1]['marker']['cmin'] = color_range[0]
+            figure_patch['data'][2 * trace + 1]['marker']['cmax'] = color_range[1]
+        state_patch['color_range'] = color_range
+
+    # Drawn items reviewed by the new users have more reviews now
+    offsets = np.cumsum([0] + state['sizes'])
+    for i, node in enumerate(neighbours, start=len(new_nodes)):
+        index = known_index[node]
+        num_reviews = state['degree'][index] + int(degree[i])
+        trace = int(np.searchsorted(offsets, index, side='right')) - 1
+        point = index - int(offsets[trace])
+        figure_patch['data'][2 * trace + 1]['text'][point] = f"Item Id: {node}<br>Reviews: {num_reviews}"
+        figure_patch['data'][2 * trace + 1]['customdata'][point] = [node, num_reviews]
+        state_patch['degree'][index] = num_reviews
+
+    # New traces with the edges of the new users and the new nodes, packed like the cached figures
+    scatter = go.Scattergl if state['type'] == 'scattergl' else go.Scatter
+    new = np.arange(len(new_nodes))
+    traces = [_edge_trace(scatter, coords, edges),
+              _node_trace(scatter, new_nodes, is_user[new], degree[new], coords[new], color_range, showscale=False)]
+    figure_patch['data'].extend(pack_arrays({'data': [trace.to_plotly_json() for trace in traces]})['data'])
+    state_patch['users'] = list(user_ids)
+    state_patch['nodes'].extend(new_nodes)
+    state_patch['degree'].extend(degree[new].tolist())
+    state_patch['x'].extend(coords[new, 0].round(6).tolist())
+    state_patch['y'].extend(coords[new, 1].round(6).tolist())
+    state_patch['sizes'].append(len(new_nodes))
+    progress(3, 3)
+    return figure_patch, state_patch
@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+from typing import Dict
+import re
+import uuid
+
+from dash.exceptions import PreventUpdate
+import pymongo.errors
+
+__all__ = ['GovernedCollection', 'QueryGovernor']
+
+# Prefix of the comment attached to every governed query
+COMMENT_PREFIX = 'dash'
+
+# Server error codes of queries killed with `killOp`
+INTERRUPTED_CODES = (11600, 11601, 11602)
+
+
+class GovernedCollection:
+    """
+    Proxy of a MongoDB collection that runs every `aggregate` and `find` with a time budget (`maxTimeMS`) and a comment
+    identifying the request, so the server stops queries nobody waits for. Anything else is delegated to the
+    collection, so the figure functions can use it as a normal collection.
+    """
+
+    def __init__(self, collection, max_time_ms: int, comment: str):
+        """
+        Parameters:
+            collection (Collection): The MongoDB collection.
+            max_time_ms (int): Time budget of each query, in milliseconds.
+            comment (str): Comment attached to each query.
+        """
+        self.collection = collection
+        self.max_time_ms = max_time_ms
+        self.comment = comment
+
+    def aggregate(self, pipeline, **kwargs):
+        kwargs.setdefault('maxTimeMS', self.max_time_ms)
+        kwargs.setdefault('comment', self.comment)
+        return self.collection.aggregate(pipeline, **kwargs)
+
+    def find(self, *args, **kwargs):
+        kwargs.setdefault('max_time_ms', self.max_time_ms)
+        kwargs.setdefault('comment', self.comment)
+        return self.collection.find(*args, **kwargs)
+
+    def find_one(self, *args, **kwargs):
+        kwargs.setdefault('max_time_ms', self.max_time_ms)
+        kwargs.setdefault('comment', self.comment)
+        return self.collection.find_one(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+class QueryGovernor:
+    """
+    Gives each dashboard request a time budget for its queries and cancels the queries of a request when a newer one
+    arrives from the same session for the same callback. Requests are identified by the comment of their queries, so
+    the in-flight state lives in MongoDB and cancellation works whichever worker process runs each request.
+    """
+
+    def __init__(self, default_budget_ms: int = 15000, budgets: Dict[str, int] = None):
+        """
+        Parameters:
+            default_budget_ms (int): Time budget of each query, in milliseconds (default: 15000).
+            budgets (dict): Budgets of specific callbacks, by name (default: None).
+        """
+        self.default_budget_ms = default_budget_ms
+        self.budgets = budgets or {}
+
+    def budget(self, name: str) -> int:
+        return self.budgets.get(name, self.default_budget_ms)
+
+    def cancel(self, collection, session_id: str, name: str):
+        """
+        Kill the queries still running for a callback of a session.
+        """
+        prefix = f'{COMMENT_PREFIX}:{session_id}:{name}:'
+        admin = collection.database.client.admin
+        try:
+            operations = admin.aggregate([
+                {'$currentOp': {'allUsers': False, 'idleConnections': False}},
+                {'$match': {'command.comment': {'$regex': f'^{re.escape(prefix)}'}}},
+                {'$project': {'opid': 1}}
+            ])
+            for operation in operations:
+                admin.command('killOp', op=operation['opid'])
+        except pymongo.errors.OperationFailure:
+            # Without privileges to list or kill operations, queries are only bounded by their budget
+            pass
+
+    @contextmanager
+    def scope(self, collection, session_id: str, name: str):
+        """
+        Context manager giving a governed collection for one request of a callback. The queries of the previous request
+        of the session are cancelled first. If the queries of this request are cancelled or exceed their budget, the
+        callback does not update its outputs.
+
+        Parameters:
+            collection (Collection): The MongoDB collection.
+            session_id (str): Identifier of the browser session.
+            name (str): Name of the callback.
+        """
+        self.cancel(collection, session_id, name)
+        comment = f'{COMMENT_PREFIX}:{session_id}:{name}:{uuid.uuid4().hex}'
+        try:
+            yield GovernedCollection(collection, self.budget(name), comment)
+        except pymongo.errors.ExecutionTimeout:
+            raise PreventUpdate
+        except pymongo.errors.OperationFailure as e:
+            if e.code in INTERRUPTED_CODES:
+                raise PreventUpdate
+            raise
@@ -0,0 +1,287 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Sequence, Tuple
+import hashlib
+import zlib
+
+import numpy as np
+
+__all__ = ['GraphLayoutEngine', 'force_layout']
+
+
+# Deterministic pseudo-random position for a node, so the same graph always gets the same layout
+def _initial_position(node: Hashable) -> np.ndarray:
+    rng = np.random.default_rng(zlib.crc32(str(node).encode()))
+    return rng.uniform(-1, 1, 2)
+
+
+# Key of a node set that is the same in every process, unlike the hash of a frozenset of strings
+def _node_set_digest(nodes: Sequence[Hashable]) -> str:
+    return hashlib.sha256('\n'.join(sorted(map(str, nodes))).encode()).hexdigest()
+
+
+# Repulsive displacement of the `targets` nodes from `sources`, with magnitude k²/distance, as the weight of each pair
+# and the (targets, sources, 2) array of their differences
+def _repulsion(targets: np.ndarray, sources: np.ndarray, k: float,
+               mass: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    delta = targets[:, None, :] - sources[None, :, :]
+    weight = k * k / np.maximum(np.einsum('ijk,ijk->ij', delta, delta), 1e-4)
+    if mass is not None:
+        weight *= mass
+    return weight, delta
+
+
+# Exact repulsion between every pair of nodes, O(n²) but fully vectorized
+def _exact_repulsion(pos: np.ndarray, k: float, targets: np.ndarray = None) -> np.ndarray:
+    weight, delta = _repulsion(pos if targets is None else pos[targets], pos, k)
+    return np.einsum('ijk,ij->ik', delta, weight)
+
+
+# Split the nodes in grid_size² cells with (almost) the same number of nodes: first in columns by x, then every column
+# in rows by y
+def _balanced_cells(pos: np.ndarray, grid_size: int) -> np.ndarray:
+    n = len(pos)
+    columns = np.empty(n, dtype=np.int64)
+    columns[np.argsort(pos[:, 0], kind='stable')] = np.arange(n) * grid_size // n
+    order = np.lexsort((pos[:, 1], columns))
+    column_start = np.searchsorted(columns[order], columns[order])
+    column_size = np.bincount(columns, minlength=grid_size)[columns[order]]
+    cells = np.empty(n, dtype=np.int64)
+    cells[order] = columns[order] * grid_size + (np.arange(n) - column_start) * grid_size // column_size
+    return cells
+
+
+# Barnes-Hut style repulsion on a grid: far nodes are replaced by the centre of mass of their cell, nodes in the same
+# cell repel each other exactly. With about sqrt(n) balanced cells this costs O(n·sqrt(n)) per iteration.
+def _grid_repulsion(pos: np.ndarray, k: float, targets: np.ndarray = None, chunk_size: int = 2048) -> np.ndarray:
+    n = len(pos)
+    targets = np.arange(n) if targets is None else targets
+    grid_size = max(int(np.ceil(n ** 0.25)), 1)
+    cells = _balanced_cells(pos, grid_size)
+    mass = np.bincount(cells, minlength=grid_size ** 2).astype(np.float64)
+    occupied = np.flatnonzero(mass)
+    centres = np.column_stack([np.bincount(cells, weights=pos[:, i], minlength=grid_size ** 2)
+                               for i in range(2)])[occupied] / mass[occupied, None]
+    mass = mass[occupied]
+
+    displacement = np.zeros((len(targets), 2))
+    for start in range(0, len(targets), chunk_size):
+        chunk = targets[start:start + chunk_size]
+        weight, delta = _repulsion(pos[chunk], centres, k, mass)
+        # The own cell is handled exactly below
+        weight[np.arange(len(chunk)), np.searchsorted(occupied, cells[chunk])] = 0
+        displacement[start:start + chunk_size] = np.einsum('ijk,ij->ik', delta, weight)
+
+    # Position of each target in `displacement`
+    target_index = np.full(n, -1)
+    target_index[targets] = np.arange(len(targets))
+    order = np.argsort(cells, kind='stable')
+    bounds = np.flatnonzero(np.diff(cells[order])) + 1
+    for members in np.split(order, bounds):
+        cell_targets = members[target_index[members] >= 0]
+        if len(members) > 1 and len(cell_targets):
+            weight, delta = _repulsion(pos[cell_targets], pos[members], k)
+            displacement[target_index[cell_targets]] += np.einsum('ijk,ij->ik', delta, weight)
+    return displacement
+
+
+def force_layout(edges: np.ndarray, pos: np.ndarray, fixed: np.ndarray = None, iterations: int = 50,
+                 temperature: float = 0.1, barnes_hut_threshold: int = 1000) -> np.ndarray:
+    """
+    Fruchterman-Reingold force directed layout.
+
+    Parameters:
+        edges (np.ndarray): (m, 2) array with the indices of the nodes joined by each edge.
+        pos (np.ndarray): (n, 2) array with the initial positions, it is not modified.
+        fixed (np.ndarray): Boolean mask of the nodes that must not move (default: none).
+        iterations (int): Number of iterations (default: 50).
+        temperature (float): Maximum displacement in the first iteration, it decreases linearly (default: 0.1).
+        barnes_hut_threshold (int): Number of nodes from which repulsion is approximated on a grid (default: 1000).
+
+    Returns:
+        np.ndarray: (n, 2) array with the final positions.
+    """
+    pos = pos.astype(np.float64).copy()
+    n = len(pos)
+    if n < 2:
+        return pos
+    # Only the forces on the nodes that can move are computed
+    movable = np.arange(n) if fixed is None else np.flatnonzero(~fixed)
+    if not len(movable):
+        return pos
+    k = np.sqrt(1.0 / n)
+    repulsion = _grid_repulsion if n > barnes_hut_threshold else _exact_repulsion
+    step = temperature / (iterations + 1)
+    for _ in range(iterations):
+        displacement = np.zeros_like(pos)
+        displacement[movable] = repulsion(pos, k, movable)
+        # Attraction along the edges
+        if len(edges):
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            attraction = delta * np.linalg.norm(delta, axis=1, keepdims=True) / k
+            np.add.at(displacement, edges[:, 0], -attraction)
+            np.add.at(displacement, edges[:, 1], attraction)
+        length = np.maximum(np.linalg.norm(displacement[movable], axis=1, keepdims=True), 0.01)
+        pos[movable] += displacement[movable] * np.minimum(length, temperature) / length
+        temperature -= step
+    return pos
+
+
+# Center the layout and scale it to [-1, 1], as networkx does
+def _rescale(pos: np.ndarray) -> np.ndarray:
+    pos = pos - pos.mean(axis=0)
+    scale = np.abs(pos).max()
+    return pos / scale if scale > 0 else pos
+
+
+class GraphLayoutEngine:
+    """
+    Computes and caches graph layouts. Layouts are cached (LRU) by node set and dataset version, and the last known
+    position of every node is kept, so when a graph only adds a few nodes to a previous one, the known nodes keep their
+    place and only the new ones are laid out around them.
+
+    Both are kept in this process and, with a `store`, in a cache on disk shared by every process using its directory,
+    so they outlive processes like those of the background callbacks, which run each job in a new process.
+    """
+
+    def __init__(self, cache_size=64, max_known_nodes=200000, iterations=50, incremental_iterations=30,
+                 barnes_hut_threshold=1000, store=None):
+        """
+        Parameters:
+            cache_size (int): Number of layouts kept in the cache of the process (default: 64).
+            max_known_nodes (int): Number of node positions remembered by the process (default: 200000).
+            iterations (int): Iterations of a layout computed from scratch (default: 50).
+            incremental_iterations (int): Iterations of a layout seeded from known positions (default: 30).
+            barnes_hut_threshold (int): Number of nodes from which repulsion is approximated (default: 1000).
+            store (diskcache.Cache): Cache shared by every process, bounded by its own size limit (default: None).
+        """
+        self.cache_size = cache_size
+        self.max_known_nodes = max_known_nodes
+        self.iterations = iterations
+        self.incremental_iterations = incremental_iterations
+        self.barnes_hut_threshold = barnes_hut_threshold
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._layouts = OrderedDict()
+        self._known = OrderedDict()
+        self._lock = Lock()
+
+    def layout(self, nodes: Sequence[Hashable], edges: np.ndarray, version: Hashable = None) -> np.ndarray:
+        """
+        Get the positions of the nodes of a graph.
+
+        Parameters:
+            nodes (Sequence): Node identifiers.
+            edges (np.ndarray): (m, 2) array with the indices (in `nodes`) of the nodes joined by each edge.
+            version (Hashable): Version of the dataset the edges come from (default: None).
+
+        Returns:
+            np.ndarray: (n, 2) array with the position of each node.
+        """
+        key = ('layout', version, _node_set_digest(nodes))
+        positions = self._cached_layout(key)
+        if positions is not None:
+            return np.array([positions[node] for node in nodes]).reshape(-1, 2)
+        known_positions = self._known_positions(nodes)
+        known = np.array([node in known_positions for node in nodes], dtype=bool)
+        pos = np.array([known_positions[node] if node in known_positions else _initial_position(node)
+                        for node in nodes]).reshape(-1, 2)
+
+        if known.sum() * 2 >= len(nodes) and known.any():
+            # Incremental layout: known nodes stay where they were and new nodes start next to their neighbours
+            pos = self._seed_new_nodes(pos, known, edges)
+            pos = force_layout(edges, pos, fixed=known, iterations=self.incremental_iterations,
+                               temperature=0.05, barnes_hut_threshold=self.barnes_hut_threshold)
+        else:
+            pos = _rescale(force_layout(edges, pos, iterations=self.iterations,
+                                        barnes_hut_threshold=self.barnes_hut_threshold))
+
+        positions = dict(zip(nodes, map(tuple, pos)))
+        self._remember(key, positions)
+        if self.store is not None:
+            # One transaction, instead of one per node
+            with self.store.transact():
+                self.store.set(key, positions)
+                for node, xy in positions.items():
+                    self.store.set(('position', node), xy)
+        return pos
+
+    def extend(self, nodes: Sequence[Hashable], edges: np.ndarray, positions: np.ndarray,
+               fixed: np.ndarray) -> np.ndarray:
+        """
+        Lay out new nodes around nodes already drawn, which keep their position. Used to add nodes to a figure the
+        browser already shows, so the layout caches are not involved.
+
+        Parameters:
+            nodes (Sequence): Node identifiers.
+            edges (np.ndarray): (m, 2) array with the indices (in `nodes`) of the nodes joined by each edge.
+            positions (np.ndarray): (n, 2) array with the positions of the fixed nodes (other rows are ignored).
+            fixed (np.ndarray): Boolean mask of the nodes already drawn.
+
+        Returns:
+            np.ndarray: (n, 2) array with the position of each node.
+        """
+        pos = np.array([positions[i] if fixed[i] else _initial_position(node)
+                        for i, node in enumerate(nodes)], dtype=np.float64).reshape(-1, 2)
+        pos = self._seed_new_nodes(pos, fixed, edges)
+        return force_layout(edges, pos, fixed=fixed, iterations=self.incremental_iterations, temperature=0.05,
+                            barnes_hut_threshold=self.barnes_hut_threshold)
+
+    # Positions of a layout, from this process or the shared store
+    def _cached_layout(self, key) -> dict:
+        with self._lock:
+            positions = self._layouts.get(key)
+            if positions is not None:
+                self._layouts.move_to_end(key)
+                self.hits += 1
+                return positions
+        positions = self.store.get(key) if self.store is not None else None
+        if positions is not None:
+            self._remember(key, positions)
+        with self._lock:
+            if positions is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return positions
+
+    # Last known positions of some nodes, from this process or the shared store
+    def _known_positions(self, nodes: Sequence[Hashable]) -> dict:
+        with self._lock:
+            positions = {node: self._known[node] for node in nodes if node in self._known}
+        if self.store is not None and len(positions) < len(nodes):
+            with self.store.transact():
+                for node in nodes:
+                    if node not in positions:
+                        xy = self.store.get(('position', node))
+                        if xy is not None:
+                            positions[node] = xy
+        return positions
+
+    # Keep a layout and the positions of its nodes in this process
+    def _remember(self, key, positions: dict):
+        with self._lock:
+            self._layouts[key] = positions
+            self._layouts.move_to_end(key)
+            while len(self._layouts) > self.cache_size:
+                self._layouts.popitem(last=False)
+            for node, xy in positions.items():
+                self._known[node] = xy
+                self._known.move_to_end(node)
+            while len(self._known) > self.max_known_nodes:
+                self._known.popitem(last=False)
+
+    # Place every new node at the mean position of its known neighbours (plus its own small offset)
+    @staticmethod
+    def _seed_new_nodes(pos: np.ndarray, known: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        pos = pos.copy()
+        if len(edges):
+            both = np.concatenate([edges, edges[:, ::-1]])
+            both = both[known[both[:, 1]] & ~known[both[:, 0]]]
+            total = np.zeros_like(pos)
+            np.add.at(total, both[:, 0], pos[both[:, 1]])
+            count = np.bincount(both[:, 0], minlength=len(pos))
+            seeded = count > 0
+            pos[seeded] = total[seeded] / count[seeded, None] + 0.05 * pos[seeded]
+        return pos
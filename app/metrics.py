@@ -0,0 +1,399 @@
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter
+from typing import Callable, Iterable, List, Tuple
+import bisect
+import math
+
+from flask import Response, g, request
+import pymongo.monitoring
+
+__all__ = ['Counter', 'Histogram', 'MetricsRegistry', 'REGISTRY', 'timed_callback', 'timed_background_callback',
+           'collect_background_timings', 'install_metrics']
+
+# Buckets of the latency histograms, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Buckets of the payload size histograms, in bytes (1 KB to 64 MB)
+SIZE_BUCKETS = tuple(float(2 ** power) for power in range(10, 27, 2))
+
+# Path of the Dash callback requests
+CALLBACK_PATH = '_dash-update-component'
+
+# Prefix of the queue of job timings in the cache shared with the background processes
+BACKGROUND_TIMINGS_PREFIX = 'metrics-background-timings'
+
+# Seconds a job timing waits in the queue for a scrape before it is dropped
+BACKGROUND_TIMINGS_EXPIRE = 3600
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        """
+        Parameters:
+            name (str): Name of the metric.
+            documentation (str): Help text of the metric.
+            labelnames (tuple): Names of the labels of the metric (default: no labels).
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(dict(zip(self.labelnames, key)), value))
+        return lines
+
+    def _samples(self, labels: dict, value) -> List[str]:
+        return [f'{self.name}{_format_labels(labels)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up, like a number of requests.
+    """
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, like latencies, counted in cumulative buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        """
+        Parameters:
+            name (str): Name of the metric.
+            documentation (str): Help text of the metric.
+            labelnames (tuple): Names of the labels of the metric (default: no labels).
+            buckets (tuple): Upper bounds of the buckets, sorted (default: `DURATION_BUCKETS`).
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # Count per bucket (the last one is +Inf) and sum of the values
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts = list(counts)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self, labels: dict, value) -> List[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": _format_value(bound)})} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+        lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of a process, rendered in the Prometheus text format. Each worker process of a WSGI server has its own
+    registry, so every worker must be scraped (or the metrics summed) to get the totals.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple]]):
+        """
+        Add a function read on each scrape, for values owned by other objects (cache sizes, pools...). It returns
+        tuples of (name, type, documentation, [(labels, value), ...]).
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.extend(f'{name}{_format_labels(labels)} {_format_value(value)}' for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+REGISTRY = MetricsRegistry()
+
+CALLBACK_DURATION = REGISTRY.histogram('dash_callback_duration_seconds',
+                                       'Duration of the Dash callback requests by phase (db, compute, serialize, '
+                                       'total).', ('callback', 'phase'))
+CALLBACK_RESPONSE_SIZE = REGISTRY.histogram('dash_callback_response_bytes', 'Size of the Dash callback responses.',
+                                            ('callback',), buckets=SIZE_BUCKETS)
+CALLBACK_REQUESTS = REGISTRY.counter('dash_callback_requests_total', 'Number of Dash callback requests by status.',
+                                     ('callback', 'status'))
+BACKGROUND_REQUEST_DURATION = REGISTRY.histogram('dash_background_request_duration_seconds',
+                                                 'Duration of the requests starting (start) or polling (poll) a '
+                                                 'background callback, not of its job.', ('callback', 'request'))
+BACKGROUND_JOB_DURATION = REGISTRY.histogram('dash_background_job_duration_seconds',
+                                             'Duration of the jobs of the background callbacks by phase (db, compute, '
+                                             'total).', ('callback', 'phase'))
+BACKGROUND_JOBS = REGISTRY.counter('dash_background_jobs_total', 'Number of background callback jobs by status.',
+                                   ('callback', 'status'))
+MONGODB_COMMAND_DURATION = REGISTRY.histogram('mongodb_command_duration_seconds', 'Duration of the MongoDB commands.',
+                                              ('command',))
+
+# Times of the request being served by the current thread
+_request_timings = local()
+
+
+class _CommandTimer(pymongo.monitoring.CommandListener):
+    # Listeners are called in the thread running the command, so the time is added to the request of that thread
+    def _record(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGODB_COMMAND_DURATION.observe(seconds, command=event.command_name)
+        if getattr(_request_timings, 'db', None) is not None:
+            _request_timings.db += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+class _PoolMonitor(pymongo.monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.open = 0
+        self.in_use = 0
+        self._lock = Lock()
+
+    def _add(self, open_=0, in_use=0):
+        with self._lock:
+            self.open += open_
+            self.in_use += in_use
+
+    def connection_created(self, event):
+        self._add(open_=1)
+
+    def connection_closed(self, event):
+        self._add(open_=-1)
+
+    def connection_checked_out(self, event):
+        self._add(in_use=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+# Listeners only apply to clients created after they are registered, which is why this happens on import
+MONGODB_POOL = _PoolMonitor()
+pymongo.monitoring.register(_CommandTimer())
+pymongo.monitoring.register(MONGODB_POOL)
+
+
+def timed_callback(func):
+    """
+    Decorator measuring the time spent in a callback function, placed under `app.callback`. The time of the request
+    outside of it (validation and JSON serialization of the outputs) is reported as the serialize phase.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _request_timings.callback = perf_counter() - start
+    return wrapper
+
+
+def timed_background_callback(store, name: str):
+    """
+    Decorator measuring the job of a background callback, placed under `app.callback`. Jobs run in their own process,
+    whose metrics are never scraped, so the db and compute times of each job are queued in `store`, the cache on disk
+    shared with the serving processes, and moved to their registry by `collect_background_timings` on each scrape.
+
+    Parameters:
+        store (diskcache.Cache): Cache shared with the serving processes, None to not measure the jobs.
+        name (str): Name of the callback in the metrics, e.g. `fig6.figure`.
+    """
+    def decorator(func):
+        if store is None:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            _request_timings.db = 0.0
+            status = 'error'
+            try:
+                result = func(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                total, db = perf_counter() - start, _request_timings.db
+                _request_timings.db = None
+                store.push((name, status, db, total), prefix=BACKGROUND_TIMINGS_PREFIX,
+                           expire=BACKGROUND_TIMINGS_EXPIRE)
+        return wrapper
+    return decorator
+
+
+def collect_background_timings(store):
+    """
+    Move the job timings queued by `timed_background_callback` to the registry of this process. With several serving
+    processes, each timing goes to the first one scraped.
+    """
+    while True:
+        key, timing = store.pull(prefix=BACKGROUND_TIMINGS_PREFIX)
+        if key is None:
+            return
+        name, status, db, total = timing
+        BACKGROUND_JOBS.inc(callback=name, status=status)
+        BACKGROUND_JOB_DURATION.observe(total, callback=name, phase='total')
+        BACKGROUND_JOB_DURATION.observe(db, callback=name, phase='db')
+        BACKGROUND_JOB_DURATION.observe(max(total - db, 0.0), callback=name, phase='compute')
+
+
+def install_metrics(app, context, path='/metrics'):
+    """
+    Time the callback requests of a dashboard and serve the metrics of the process in the Prometheus text format.
+
+    Parameters:
+        app (Dash): The dashboard.
+        context (DashboardContext): The context of the dashboard, with its caches and pools.
+        path (str): Path of the metrics endpoint (default: '/metrics').
+    """
+    server = app.server
+
+    @server.before_request
+    def start_request_timer():
+        if request.path.endswith(CALLBACK_PATH):
+            g.metrics_start = perf_counter()
+            _request_timings.db = 0.0
+            _request_timings.callback = None
+
+    @server.after_request
+    def record_request_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        total = perf_counter() - start
+        db, callback = _request_timings.db, _request_timings.callback
+        _request_timings.db = _request_timings.callback = None
+        # Callbacks are named by their outputs, e.g. `fig1.figure`
+        name = (request.get_json(silent=True) or {}).get('output', 'unknown')
+        CALLBACK_REQUESTS.inc(callback=name, status=response.status_code)
+        if app.callback_map.get(name, {}).get('long'):
+            # The work of a background callback runs in its job, measured by `timed_background_callback`: requests
+            # only start the job or poll its progress
+            BACKGROUND_REQUEST_DURATION.observe(total, callback=name,
+                                                request='poll' if request.args.get('cacheKey') else 'start')
+            return response
+        CALLBACK_DURATION.observe(total, callback=name, phase='total')
+        CALLBACK_DURATION.observe(db, callback=name, phase='db')
+        if callback is not None:
+            CALLBACK_DURATION.observe(max(callback - db, 0.0), callback=name, phase='compute')
+            CALLBACK_DURATION.observe(max(total - callback, 0.0), callback=name, phase='serialize')
+        if not response.direct_passthrough:
+            CALLBACK_RESPONSE_SIZE.observe(len(response.get_data()), callback=name)
+        return response
+
+    @server.route(path)
+    def metrics():
+        collect_background_timings(context.shared_cache)
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    REGISTRY.add_collector(lambda: _collect_context(context))
+
+
+def _collect_context(context) -> List[tuple]:
+    cache = context.figure_cache.stats()
+    return [
+        ('figure_cache_hits_total', 'counter', 'Hits of the figure cache by tier.',
+         [({'tier': 'memory'}, cache['memory_hits']), ({'tier': 'disk'}, cache['disk_hits'])]),
+        ('figure_cache_misses_total', 'counter', 'Misses of the figure cache.', [({}, cache['misses'])]),
+        ('figure_cache_hit_ratio', 'gauge', 'Share of the figure cache requests that were hits.',
+         [({}, cache['hit_rate'])]),
+        ('figure_cache_memory_bytes', 'gauge', 'Size of the in-process tier of the figure cache.',
+         [({}, cache['memory_bytes'])]),
+        ('mongodb_pool_connections', 'gauge', 'Connections of the MongoDB pools by state.',
+         [({'state': 'open'}, MONGODB_POOL.open), ({'state': 'in_use'}, MONGODB_POOL.in_use)]),
+        ('mysql_pool_size', 'gauge', 'Size of the MySQL connection pool.', [({}, context.mysql_pool_size)]),
+        ('mysql_pool_connections_in_use', 'gauge', 'MySQL connections in use by table searched.',
+         [({'table': search.table}, search.in_use) for search in (context.item_search, context.user_search)])
+    ]
@@ -0,0 +1,63 @@
+from threading import Lock
+from typing import List
+
+import mysql.connector.pooling
+
+__all__ = ['IdSearch']
+
+
+class IdSearch:
+    """
+    Prefix search over the ids of a MySQL table (`users` or `items`). Queries are range seeks on the primary key index,
+    bounded by `limit`, so the dropdowns never load the whole table.
+
+    Each query holds a connection of the pool while it runs. The pool does not wait for a free connection, it raises
+    PoolError, so it needs a connection for every thread of the process that can search at once.
+    """
+
+    def __init__(self, pool: mysql.connector.pooling.MySQLConnectionPool, table: str):
+        """
+        Parameters:
+            pool (MySQLConnectionPool): Pool of connections to the database of the table.
+            table (str): Name of the table, with the ids in its `id` primary key.
+        """
+        self.pool = pool
+        self.table = table
+        # Connections of the pool currently used by this search
+        self.in_use = 0
+        self._lock = Lock()
+
+    def search(self, prefix: str = '', limit: int = 50) -> List[str]:
+        """
+        Get the ids starting with a prefix, in order.
+
+        Parameters:
+            prefix (str): Start of the ids (default: any id).
+            limit (int): Maximum number of ids returned (default: 50).
+        """
+        # Escape the LIKE wildcards, so the prefix is matched literally
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return [row[0] for row in self._fetch(f"SELECT id FROM {self.table} WHERE id LIKE %s ORDER BY id LIMIT %s",
+                                              [pattern, limit])]
+
+    def exists(self, value: str) -> bool:
+        """
+        Check whether an id exists.
+        """
+        return bool(self._fetch(f"SELECT 1 FROM {self.table} WHERE id = %s LIMIT 1", [value]))
+
+    def _fetch(self, query, params):
+        conn = self.pool.get_connection()
+        with self._lock:
+            self.in_use += 1
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            # Returns the connection to the pool
+            conn.close()
+            with self._lock:
+                self.in_use -= 1
@@ -0,0 +1,179 @@
+from datetime import datetime
+from threading import Lock, Thread
+from time import monotonic
+from typing import Collection, List, Tuple
+import json
+import os
+import tempfile
+
+from utils.metadata import get_dataset_counts, write_dataset_counts, get_category_stats, write_category_stats
+
+__all__ = ['StatsService']
+
+
+class StatsService:
+    """
+    Serves the number of users, items and reviews shown in the header cards, and the number of reviews and date range of
+    each category. Stats come from the metadata written by the ETL and are kept in memory for `ttl` seconds, so reading
+    them does not depend on the collection size.
+
+    With a snapshot file, the stats are also saved locally each time they are read. A new process serves the saved stats
+    at once and reads the database in the background.
+    """
+
+    def __init__(self, collection, ttl=60.0, snapshot_path: str = None):
+        """
+        Parameters:
+            collection (Collection): The MongoDB reviews collection.
+            ttl (float): Seconds the stats are kept before they are read again (default: 60).
+            snapshot_path (str): File where the stats are saved, None to disable it (default: None).
+        """
+        self.collection = collection
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._counts = None
+        self._category_stats = None
+        self._read_time = None
+        self._lock = Lock()
+        self._read_lock = Lock()
+        if snapshot_path and self._load_snapshot():
+            Thread(target=self.update, daemon=True).start()
+
+    def counts(self) -> dict:
+        """
+        Get the number of users, items and reviews.
+
+        Returns:
+            dict: {'users': int, 'items': int, 'reviews': int}
+        """
+        self._ensure_fresh()
+        with self._lock:
+            return dict(self._counts)
+
+    def category_stats(self) -> dict:
+        """
+        Get the number of reviews and first and last review time of every category.
+
+        Returns:
+            dict: {category: {'count': int, 'min_date': datetime, 'max_date': datetime}}
+        """
+        self._ensure_fresh()
+        with self._lock:
+            return self._category_stats
+
+    def categories(self) -> List[str]:
+        """
+        Get the names of the categories, sorted.
+        """
+        return sorted(self.category_stats())
+
+    def date_bounds(self, categories: Collection[str]) -> Tuple[datetime, datetime]:
+        """
+        Get the first and last review time of a set of categories, (None, None) if they have no reviews.
+        """
+        category_stats = self.category_stats()
+        selected = [category_stats[category] for category in categories if category in category_stats]
+        min_dates = [stats['min_date'] for stats in selected if stats['min_date'] is not None]
+        max_dates = [stats['max_date'] for stats in selected if stats['max_date'] is not None]
+        if not min_dates or not max_dates:
+            return None, None
+        return min(min_dates), max(max_dates)
+
+    def refresh(self):
+        """
+        Force the stats to be read again on the next call.
+        """
+        with self._lock:
+            self._read_time = None
+
+    def update(self):
+        """
+        Read the stats from the database now, and save them to the snapshot file.
+        """
+        with self._read_lock:
+            self._update()
+
+    def _ensure_fresh(self):
+        with self._lock:
+            read_time = self._read_time
+        if read_time is None or monotonic() - read_time > self.ttl:
+            with self._read_lock:
+                # Another thread may have read them while this one waited
+                with self._lock:
+                    read_time = self._read_time
+                if read_time is None or monotonic() - read_time > self.ttl:
+                    self._update()
+
+    def _update(self):
+        counts, category_stats = self._read_counts(), self._read_category_stats()
+        with self._lock:
+            self._counts, self._category_stats = counts, category_stats
+            self._read_time = monotonic()
+        if self.snapshot_path:
+            self._save_snapshot(counts, category_stats)
+
+    def _read_counts(self) -> dict:
+        counts = get_dataset_counts(self.collection.database)
+        if counts is not None:
+            return counts
+        # Databases loaded before the counts were written: use the collection metadata for the number of reviews, count
+        # users and items once and store them for the next time
+        counts = {'reviews': self.collection.estimated_document_count()}
+        for name, field in (('users', 'reviewer_id'), ('items', 'item_id')):
+            response = list(self.collection.aggregate([
+                {'$group': {'_id': f'${field}'}},
+                {'$count': 'total'}
+            ], allowDiskUse=True))
+            counts[name] = response[0]['total'] if response else 0
+        write_dataset_counts(self.collection.database, **counts)
+        return counts
+
+    def _read_category_stats(self) -> dict:
+        category_stats = get_category_stats(self.collection.database)
+        if category_stats is not None:
+            return category_stats
+        # Databases loaded before the stats were written: compute them once and store them for the next time
+        response = self.collection.aggregate([
+            {'$group': {'_id': '$category', 'count': {'$sum': 1},
+                        'min_date': {'$min': '$reviewTime'}, 'max_date': {'$max': '$reviewTime'}}}
+        ])
+        category_stats = {stats.pop('_id'): stats for stats in response if stats['_id'] is not None}
+        write_category_stats(self.collection.database, category_stats)
+        return category_stats
+
+    # The snapshot is only used for the collection it was saved from. Returns whether it was loaded
+    def _load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get('collection') != self.collection.full_name:
+            return False
+        category_stats = {}
+        for name, stats in snapshot['categories'].items():
+            category_stats[name] = {
+                'count': stats['count'],
+                'min_date': datetime.fromisoformat(stats['min_date']) if stats['min_date'] else None,
+                'max_date': datetime.fromisoformat(stats['max_date']) if stats['max_date'] else None
+            }
+        with self._lock:
+            self._counts, self._category_stats = snapshot['counts'], category_stats
+            self._read_time = monotonic()
+        return True
+
+    def _save_snapshot(self, counts, category_stats):
+        snapshot = {
+            'collection': self.collection.full_name,
+            'counts': counts,
+            'categories': {name: {'count': stats['count'],
+                                  'min_date': stats['min_date'].isoformat() if stats['min_date'] else None,
+                                  'max_date': stats['max_date'].isoformat() if stats['max_date'] else None}
+                           for name, stats in category_stats.items()}
+        }
+        # Write to a temporary file first, so other processes never read a partial snapshot
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
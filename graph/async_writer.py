@@ -0,0 +1,120 @@
+from itertools import groupby
+from typing import Callable, Iterable, Iterator, List
+import asyncio
+
+import neo4j
+
+from graph.graph_data import GraphData
+from graph.writer import _batches, _node_query, _node_rows, _relationship_query, _relationship_rows, _schema_queries
+from utils.database import connect_to_neo4j_async
+
+__all__ = ['AsyncGraphWriter']
+
+# Modes of `AsyncGraphWriter.write`
+ASYNC_WRITE_MODES = ('reset', 'append')
+
+
+# Batches of relationships where each start node is in a single batch, so concurrent batches don't lock the same
+# start nodes. Batches are cut at the first start node change after `size` rows
+def _batches_by_start(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for _, group in groupby(sorted(rows, key=lambda row: str(row['start'])), key=lambda row: str(row['start'])):
+        batch.extend(group)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class AsyncGraphWriter:
+    """
+    Writes graphs to Neo4j like a GraphWriter, but with the async driver, keeping up to `concurrency` batches in flight
+    instead of waiting for each one. The nodes of every label are written concurrently, then the relationships of each
+    type, split in batches that don't share start nodes. Batches still conflicting on their end nodes (e.g. a popular
+    item) may deadlock: those transient errors are retried by the driver for up to `max_retry_time` seconds.
+
+    Graphs are written from scratch ('reset') or on top of the database ('append'). Syncing a graph with the one in
+    the database is done by GraphWriter.
+    """
+
+    def __init__(self, connect: Callable[..., neo4j.AsyncDriver] = connect_to_neo4j_async, batch_size: int = 10000,
+                 database: str = None, concurrency: int = 4, max_retry_time: float = 30.0, mode: str = 'reset'):
+        """
+        Parameters:
+            connect (Callable): Returns a new async driver, given its configuration (default: connect_to_neo4j_async).
+            batch_size (int): Number of rows written or deleted in each transaction (default: 10000).
+            database (str): Name of the Neo4j database (default: the default database of the server).
+            concurrency (int): Maximum number of transactions running at once (default: 4).
+            max_retry_time (float): Seconds a transaction is retried after transient errors (default: 30).
+            mode (str): Default mode of `write`, 'reset' or 'append' (default: 'reset').
+        """
+        if mode not in ASYNC_WRITE_MODES:
+            raise ValueError(f"Unknown write mode. Available modes are {list(ASYNC_WRITE_MODES)}")
+        self.connect = connect
+        self.batch_size = batch_size
+        self.database = database
+        self.concurrency = concurrency
+        self.max_retry_time = max_retry_time
+        self.mode = mode
+
+    def write(self, graph: GraphData, mode: str = None):
+        """
+        Write a graph from synchronous code, see `write_async`.
+        """
+        asyncio.run(self.write_async(graph, mode))
+
+    async def write_async(self, graph: GraphData, mode: str = None):
+        """
+        Write a graph: first every node, then every relationship.
+
+        Parameters:
+            graph (GraphData): The graph.
+            mode (str): 'reset' or 'append' (default: the mode of the writer).
+        """
+        mode = mode or self.mode
+        if mode not in ASYNC_WRITE_MODES:
+            raise ValueError(f"Unknown write mode. Available modes are {list(ASYNC_WRITE_MODES)}")
+        # The driver is opened in the event loop running the writes
+        async with self.connect(max_transaction_retry_time=self.max_retry_time) as driver:
+            await self._ensure_schema(driver)
+            if mode == 'reset':
+                await self._reset(driver)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._run_batch(driver, semaphore, _node_query(label), batch)
+                                   for label, nodes in graph.nodes.items()
+                                   for batch in _batches(_node_rows(nodes), self.batch_size)))
+            # Types one after another, the batches of two types could share start nodes
+            for (rel_type, start_label, end_label), relationships in graph.relationships.items():
+                query = _relationship_query(rel_type, start_label, end_label)
+                await asyncio.gather(*(self._run_batch(driver, semaphore, query, batch)
+                                       for batch in _batches_by_start(_relationship_rows(relationships),
+                                                                      self.batch_size)))
+
+    async def _ensure_schema(self, driver: neo4j.AsyncDriver):
+        async with driver.session(database=self.database) as session:
+            for query in _schema_queries():
+                result = await session.run(query)
+                await result.consume()
+
+    # Deletions run one batch at a time, concurrent ones would compete for the same nodes
+    async def _reset(self, driver: neo4j.AsyncDriver):
+        async with driver.session(database=self.database) as session:
+            while await session.execute_write(self._delete_batch, self.batch_size):
+                pass
+
+    async def _run_batch(self, driver: neo4j.AsyncDriver, semaphore: asyncio.Semaphore, query: str, batch: List[dict]):
+        async with semaphore:
+            async with driver.session(database=self.database) as session:
+                await session.execute_write(self._write_batch, query, batch)
+
+    @staticmethod
+    async def _write_batch(tx: neo4j.AsyncManagedTransaction, query: str, batch: List[dict]):
+        result = await tx.run(query, rows=batch)
+        await result.consume()
+
+    @staticmethod
+    async def _delete_batch(tx: neo4j.AsyncManagedTransaction, batch_size: int) -> int:
+        result = await tx.run("MATCH (n) WITH n LIMIT $batch DETACH DELETE n RETURN count(*)", batch=batch_size)
+        record = await result.single()
+        return record[0]
@@ -0,0 +1,147 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Tuple
+import csv
+import gzip
+import os
+
+from graph.graph_data import GraphData
+from graph.writer import _schema_queries
+
+__all__ = ['BulkImportWriter']
+
+# Separator of the values of array properties, the default of the importer
+ARRAY_DELIMITER = ';'
+
+
+# Type of a property in the header of the importer, from its Python value
+def _value_type(value) -> str:
+    if isinstance(value, (list, tuple)):
+        types = {_value_type(item) for item in value if item is not None}
+        return (types.pop() if len(types) == 1 else 'string') + '[]'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'long'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, datetime):
+        return 'datetime' if value.tzinfo else 'localdatetime'
+    if isinstance(value, date):
+        return 'date'
+    return 'string'
+
+
+# Names and types of the properties of some elements. A property with values of several types is written as a string
+def _property_types(properties: Iterable[dict]) -> Dict[str, str]:
+    types = {}
+    for element in properties:
+        for name, value in element.items():
+            # Empty lists have no type of their own
+            if value is None or (isinstance(value, (list, tuple)) and not value):
+                continue
+            value_type = _value_type(value)
+            if types.setdefault(name, value_type) != value_type:
+                types[name] = 'string'
+    return types
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ARRAY_DELIMITER.join(_format_value(item) for item in value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+# Write the header file and stream the rows to the data file, returning their paths
+def _write_files(directory: str, compress: bool, name: str, header: List[str],
+                 rows: Iterable[list]) -> Tuple[str, str]:
+    header_path = os.path.join(directory, f'{name}_header.csv')
+    with open(header_path, 'w', newline='') as f:
+        csv.writer(f).writerow(header)
+    data_path = os.path.join(directory, f'{name}.csv' + ('.gz' if compress else ''))
+    with (gzip.open(data_path, 'wt', newline='') if compress else open(data_path, 'w', newline='')) as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([_format_value(value) for value in row])
+    return header_path, data_path
+
+
+# Files of the nodes of a label. Module level functions, so they can run in the worker processes
+def _write_nodes(directory: str, compress: bool, label: str, nodes: Dict) -> Tuple[str, str]:
+    types = _property_types(nodes.values())
+    names = [name for name in types if name != 'id']
+    header = [f'id:ID({label})'] + [f'{name}:{types[name]}' for name in names] + [':LABEL']
+    rows = ([node_id] + [properties.get(name) for name in names] + [label]
+            for node_id, properties in nodes.items())
+    return _write_files(directory, compress, f'nodes_{label}', header, rows)
+
+
+def _write_relationships(directory: str, compress: bool, key: Tuple[str, str, str],
+                         relationships: List[tuple]) -> Tuple[str, str]:
+    rel_type, start_label, end_label = key
+    types = _property_types(properties for _, _, properties in relationships)
+    names = list(types)
+    header = [f':START_ID({start_label})', f':END_ID({end_label})', ':TYPE'] + \
+             [f'{name}:{types[name]}' for name in names]
+    rows = ([start, end, rel_type] + [properties.get(name) for name in names]
+            for start, end, properties in relationships)
+    return _write_files(directory, compress, f'relationships_{rel_type}_{start_label}_{end_label}', header, rows)
+
+
+class BulkImportWriter:
+    """
+    Writes graphs as the CSV files of the offline importer (`neo4j-admin database import full`), the fastest way to
+    build a large graph in an empty database. Each label and relationship type has a header file, with typed properties
+    and the label as ID space, and a data file streamed row by row. Files are written by a pool of processes, since
+    formatting the rows takes most of the time; each process gets a copy of the elements of its file.
+
+    The importer builds no indexes, so the constraints and indexes of GraphWriter are written to `schema.cypher`, to be
+    run once the database is started.
+
+    It can be used instead of a GraphWriter: `write` exports the graph and returns the arguments of the importer.
+    """
+
+    def __init__(self, directory: str, workers: int = 4, compress: bool = False, overwrite: bool = False):
+        """
+        Parameters:
+            directory (str): Directory of the files, created if needed.
+            workers (int): Number of processes writing files (default: 4).
+            compress (bool): Whether the data files are compressed with gzip (default: False).
+            overwrite (bool): Whether the importer replaces the target database, otherwise it must not exist
+                              (default: False).
+        """
+        self.directory = directory
+        self.workers = workers
+        self.compress = compress
+        self.overwrite = overwrite
+        self.schema_path = os.path.join(directory, 'schema.cypher')
+
+    def write(self, graph: GraphData) -> List[str]:
+        """
+        Write the files of a graph, and the schema queries to `schema_path`.
+
+        Returns:
+            list: Arguments of `neo4j-admin database import full` to import them.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with ProcessPoolExecutor(self.workers) as executor:
+            nodes = [executor.submit(_write_nodes, self.directory, self.compress, label, nodes)
+                     for label, nodes in graph.nodes.items()]
+            relationships = [executor.submit(_write_relationships, self.directory, self.compress, key, relationships)
+                             for key, relationships in graph.relationships.items()]
+            arguments = [f'--nodes={label}={header},{data}'
+                         for label, (header, data) in zip(graph.nodes, (future.result() for future in nodes))]
+            arguments += [f'--relationships={rel_type}={header},{data}'
+                          for (rel_type, _, _), (header, data) in zip(graph.relationships,
+                                                                      (future.result() for future in relationships))]
+        with open(self.schema_path, 'w') as f:
+            f.writelines(f'{query};\n' for query in _schema_queries(graph.nodes))
+        options = ['--overwrite-destination'] if self.overwrite else []
+        return ['neo4j-admin', 'database', 'import', 'full'] + options + [f'--array-delimiter={ARRAY_DELIMITER}'] + \
+            arguments
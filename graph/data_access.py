@@ -0,0 +1,113 @@
+from typing import Dict, List, Sequence, Tuple
+
+from pymongo.collection import Collection
+
+__all__ = ['top_reviewers_items', 'item_reviews', 'user_category_counts', 'popular_items_reviewers']
+
+
+# Items of another collection joined on an indexed field, only keeping `item_id`. Lookups with both `localField` and
+# `pipeline` need MongoDB 5.0, like the `$dateTrunc` of the dashboard
+def _lookup_items(collection: Collection, local_field: str, foreign_field: str, as_field: str) -> dict:
+    return {'$lookup': {'from': collection.name, 'localField': local_field, 'foreignField': foreign_field,
+                        'pipeline': [{'$project': {'_id': 0, 'item_id': 1}}], 'as': as_field}}
+
+
+def top_reviewers_items(collection: Collection, n_users: int) -> Dict[str, List[str]]:
+    """
+    Get the users with the most reviews and the items each of them reviewed, in a single aggregation.
+
+    Parameters:
+        collection (Collection): The MongoDB reviews collection.
+        n_users (int): Number of users.
+
+    Returns:
+        dict: {user: [item, ...]}, from the user with the most reviews to the one with the fewest.
+    """
+    response = collection.aggregate([
+        {'$group': {'_id': '$reviewer_id', 'rev_amount': {'$sum': 1}}},
+        {'$sort': {'rev_amount': -1}},
+        {'$limit': n_users},
+        _lookup_items(collection, '_id', 'reviewer_id', 'items'),
+        {'$project': {'items': '$items.item_id'}}
+    ], allowDiskUse=True)
+    return {user['_id']: user['items'] for user in response}
+
+
+def item_reviews(collection: Collection, item_ids: Sequence[str]) -> Dict[str, dict]:
+    """
+    Get the reviewers, ratings and times of the reviews of some items, in a single aggregation.
+
+    Parameters:
+        collection (Collection): The MongoDB reviews collection.
+        item_ids (Sequence): Ids of the items.
+
+    Returns:
+        dict: {item: {'reviewers': [...], 'overall': [...], 'reviewTime': [...]}} of every item, with empty lists for
+              the items without reviews.
+    """
+    reviews = {item: {'reviewers': [], 'overall': [], 'reviewTime': []} for item in item_ids}
+    response = collection.aggregate([
+        {'$match': {'item_id': {'$in': list(reviews)}}},
+        {'$group': {'_id': '$item_id', 'reviewers': {'$push': '$reviewer_id'}, 'overall': {'$push': '$overall'},
+                    'reviewTime': {'$push': '$reviewTime'}}}
+    ])
+    for item in response:
+        reviews[item.pop('_id')] = item
+    return reviews
+
+
+def user_category_counts(collection: Collection, user_ids: Sequence[str], min_categories: int = 2) -> Dict[str, dict]:
+    """
+    Get the number of reviews of some users in each category, in a single aggregation.
+
+    Parameters:
+        collection (Collection): The MongoDB reviews collection.
+        user_ids (Sequence): Ids of the users.
+        min_categories (int): Users with reviews in fewer categories are left out (default: 2).
+
+    Returns:
+        dict: {user: {'categories': [...], 'count': [...]}}, sorted by user.
+    """
+    response = collection.aggregate([
+        {'$match': {'reviewer_id': {'$in': list(user_ids)}}},
+        {'$group': {'_id': {'user': '$reviewer_id', 'category': '$category'}, 'count': {'$sum': 1}}},
+        {'$group': {'_id': '$_id.user', 'categories': {'$push': '$_id.category'}, 'count': {'$push': '$count'}}},
+        {'$match': {f'categories.{min_categories - 1}': {'$exists': True}}},
+        {'$sort': {'_id': 1}}
+    ])
+    return {user.pop('_id'): user for user in response}
+
+
+def popular_items_reviewers(collection: Collection, n_items: int,
+                            max_reviews: int = 40) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """
+    Get the items with the most reviews (below a maximum), their reviewers and every item those reviewers reviewed, in
+    a single aggregation.
+
+    Parameters:
+        collection (Collection): The MongoDB reviews collection.
+        n_items (int): Number of items.
+        max_reviews (int): Items with this number of reviews or more are left out (default: 40).
+
+    Returns:
+        tuple: ({item: [user, ...]}, {user: [item, ...]}), with one entry per review in the lists.
+    """
+    response = collection.aggregate([
+        {'$group': {'_id': '$item_id', 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$lt': max_reviews}}},
+        {'$sort': {'count': -1}},
+        {'$limit': n_items},
+        {'$lookup': {'from': collection.name, 'localField': '_id', 'foreignField': 'item_id',
+                     'pipeline': [{'$project': {'_id': 0, 'reviewer_id': 1}}], 'as': 'reviews'}},
+        {'$unwind': '$reviews'},
+        # Each user once, with the popular items they reviewed, before looking up all of their items
+        {'$group': {'_id': '$reviews.reviewer_id', 'popular_items': {'$push': '$_id'}}},
+        _lookup_items(collection, '_id', 'reviewer_id', 'items'),
+        {'$project': {'popular_items': 1, 'items': '$items.item_id'}}
+    ], allowDiskUse=True)
+    item_users, user_items = {}, {}
+    for user in response:
+        for item in user['popular_items']:
+            item_users.setdefault(item, []).append(user['_id'])
+        user_items[user['_id']] = user['items']
+    return item_users, user_items
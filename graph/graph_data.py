@@ -0,0 +1,43 @@
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+__all__ = ['GraphData']
+
+
+class GraphData:
+    """
+    Nodes and relationships of a graph, built in memory before being written to Neo4j. Nodes are identified by their
+    label and `id` property, relationships by their type and the labels of their start and end nodes.
+    """
+
+    def __init__(self):
+        # {label: {id: properties}}
+        self.nodes: Dict[str, Dict[Hashable, dict]] = {}
+        # {(type, start label, end label): [(start id, end id, properties)]}
+        self.relationships: Dict[Tuple[str, str, str], List[Tuple[Hashable, Hashable, dict]]] = {}
+
+    def add_node(self, label: str, node_id: Hashable, **properties):
+        """
+        Add a node, or update the properties of a node already added.
+        """
+        self.nodes.setdefault(label, {}).setdefault(node_id, {}).update(properties)
+
+    def add_nodes(self, label: str, node_ids: Iterable[Hashable]):
+        """
+        Add several nodes without properties.
+        """
+        nodes = self.nodes.setdefault(label, {})
+        for node_id in node_ids:
+            nodes.setdefault(node_id, {})
+
+    def add_relationship(self, rel_type: str, start_label: str, start_id: Hashable, end_label: str, end_id: Hashable,
+                         **properties):
+        """
+        Add a relationship between two nodes. The nodes must be added too.
+        """
+        self.relationships.setdefault((rel_type, start_label, end_label), []).append((start_id, end_id, properties))
+
+    def node_count(self) -> int:
+        return sum(len(nodes) for nodes in self.nodes.values())
+
+    def relationship_count(self) -> int:
+        return sum(len(relationships) for relationships in self.relationships.values())
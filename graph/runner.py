@@ -0,0 +1,124 @@
+from typing import Dict, List
+import argparse
+import csv
+import json
+import sys
+
+from graph.timing import PhaseTimer
+
+__all__ = ['run', 'run_spec', 'main']
+
+# Function of each section, and its size argument
+SECTIONS = {1: ('section_1', 'n_users'), 2: ('section_2', 'n'), 3: ('section_3', 'n_users'),
+            4: ('section_4', 'n_items')}
+
+# Phases timed by the sections, in the order of the results
+PHASES = ('mysql_fetch', 'mongo_fetch', 'compute', 'neo4j_write', 'read_query')
+
+
+def run(section: int, sizes: List[int], repeat: int = 1, method: str = None, categories: List[str] = None,
+        mode: str = None) -> List[Dict]:
+    """
+    Run a section once per size (and repetition), timing its phases.
+
+    Parameters:
+        section (int): Number of the section, 1 to 4.
+        sizes (list): Values of the size of the section (users of sections 1 and 3, items of sections 2 and 4).
+        repeat (int): Runs of each size (default: 1).
+        method (str): Similarity method of section 1, 'exact' or 'minhash' (default: 'exact').
+        categories (list): Categories of the items of section 2 (default: every category).
+        mode (str): Write mode of the graphs, 'reset', 'sync' or 'append' (default: the mode of the script writer).
+
+    Returns:
+        list: {'section', 'size', 'run', <phase seconds>..., 'total'} of each run.
+    """
+    # The script connects to the databases on import
+    import neo4JProyecto
+
+    if section not in SECTIONS:
+        raise ValueError(f"Unknown section. Available sections are {list(SECTIONS)}")
+    name, size_argument = SECTIONS[section]
+    kwargs = {}
+    if mode is not None:
+        kwargs['writer'] = neo4JProyecto.GraphWriter(neo4JProyecto.NEO_DRIVER,
+                                                     batch_size=neo4JProyecto.GRAPH_WRITER.batch_size, mode=mode)
+    if section == 1 and method is not None:
+        kwargs['method'] = method
+    if section == 2:
+        sampler = neo4JProyecto.ItemSampler(neo4JProyecto.MYSLQ_CONN)
+        kwargs['sampler'] = sampler
+        kwargs['categories'] = categories or sampler.categories()
+
+    results = []
+    for size in sizes:
+        for repetition in range(repeat):
+            timer = PhaseTimer()
+            getattr(neo4JProyecto, name)(**{size_argument: size}, timer=timer, **kwargs)
+            result = {'section': section, 'size': size, 'run': repetition + 1}
+            result.update({phase: round(timer.phases[phase], 4) for phase in PHASES if phase in timer.phases})
+            result['total'] = round(timer.total(), 4)
+            results.append(result)
+            print(_format_result(result), file=sys.stderr)
+    return results
+
+
+def run_spec(path: str) -> List[Dict]:
+    """
+    Run every run of a JSON spec file, a list of runs with the arguments of `run`:
+
+        {"runs": [{"section": 1, "sizes": [100, 1000, 10000], "repeat": 3},
+                  {"section": 2, "sizes": [1000, 10000], "categories": ["Digital music"], "mode": "reset"}]}
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    results = []
+    for options in spec['runs']:
+        results.extend(run(**options))
+    return results
+
+
+def _format_result(result: Dict) -> str:
+    phases = ', '.join(f'{phase} {result[phase]:.3f}s' for phase in PHASES if phase in result)
+    return f"section {result['section']} size {result['size']} run {result['run']}: {phases}, " \
+           f"total {result['total']:.3f}s"
+
+
+def _write_results(results: List[Dict], output):
+    columns = ['section', 'size', 'run'] + [phase for phase in PHASES if any(phase in result for result in results)] + \
+              ['total']
+    writer = csv.DictWriter(output, columns)
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Run the sections of the neo4j project and time their phases',
+                                     epilog='example: python -m graph.runner --section 1 --sizes 100 1000 10000 '
+                                            '--method minhash --output section_1.csv')
+    parser.add_argument('--spec', help='JSON file with the runs, instead of the options below')
+    parser.add_argument('--section', type=int, choices=sorted(SECTIONS), help='section to run')
+    parser.add_argument('--sizes', type=int, nargs='+', help='sizes of the section (users or items)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each size')
+    parser.add_argument('--method', choices=['exact', 'minhash'], help='similarity method of section 1')
+    parser.add_argument('--categories', nargs='+', help='categories of the items of section 2 (default: all)')
+    parser.add_argument('--mode', choices=['reset', 'sync', 'append'], help='write mode of the graphs')
+    parser.add_argument('--output', help='CSV file of the timings (default: standard output)')
+    args = parser.parse_args(argv)
+
+    if args.spec:
+        results = run_spec(args.spec)
+    elif args.section and args.sizes:
+        results = run(args.section, args.sizes, repeat=args.repeat, method=args.method, categories=args.categories,
+                      mode=args.mode)
+    else:
+        parser.error('either --spec or --section and --sizes are required')
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            _write_results(results, f)
+    else:
+        _write_results(results, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
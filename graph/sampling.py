@@ -0,0 +1,131 @@
+from typing import List, Sequence
+import random
+
+import mysql.connector
+
+__all__ = ['ItemSampler']
+
+# Draws seeked in a single query
+SEEK_BATCH_SIZE = 100
+
+
+class ItemSampler:
+    """
+    Random samples of the items of some categories. Items loaded by the ETL have a random key, uniform in [0, 1) and
+    indexed with their category, so each item of a sample is drawn with an index seek: the first key after a random
+    point, wrapping around to the first key. This avoids `ORDER BY RAND()`, which draws a key for every row and sorts
+    them all. The draws are independent, and draws of an item already in the sample are repeated. A draw picks an item
+    with a chance equal to the key range before it, 1 / (number of items) on average over loads, since keys are drawn
+    independently of the items.
+
+    Samples of half the items or more, and samples of databases loaded before the keys existed, are taken with a
+    reservoir over the items of the categories: a single pass without sorting, exactly uniform. `add_rand_key` adds the
+    keys to such a database without reloading it.
+    """
+
+    def __init__(self, connection: mysql.connector.MySQLConnection, seed: int = None):
+        """
+        Parameters:
+            connection (MySQLConnection): Connection to the database with the items table.
+            seed (int): Seed of the samples (default: random).
+        """
+        self.connection = connection
+        self.random = random.Random(seed)
+        self._has_rand_key = None
+
+    def categories(self) -> List[str]:
+        """
+        Get the categories of the items.
+        """
+        return [row[0] for row in self._fetch("SELECT DISTINCT category FROM items", [])]
+
+    def sample(self, categories: Sequence[str], n: int) -> List[str]:
+        """
+        Get the ids of n random items of some categories, or of all of them if there are fewer.
+
+        Parameters:
+            categories (Sequence): Categories of the items.
+            n (int): Size of the sample.
+        """
+        if not categories or n <= 0:
+            return []
+        if self.has_rand_key():
+            categories = list(dict.fromkeys(categories))
+            # Draws are repeated more and more often as the sample grows, a full pass is cheaper past half the items
+            if n * 2 < self._count(categories):
+                return self._seek_sample(categories, n)
+        return self._reservoir_sample(categories, n)
+
+    def has_rand_key(self) -> bool:
+        if self._has_rand_key is None:
+            self._has_rand_key = bool(self._fetch("SHOW COLUMNS FROM items LIKE 'rand_key'", []))
+        return self._has_rand_key
+
+    def add_rand_key(self):
+        """
+        Add the random keys, and their index, to the items of a database loaded before they existed.
+        """
+        if self.has_rand_key():
+            return
+        cursor = self.connection.cursor()
+        cursor.execute("ALTER TABLE items ADD COLUMN rand_key DOUBLE NOT NULL DEFAULT 0")
+        cursor.execute("UPDATE items SET rand_key = RAND()")
+        cursor.execute("ALTER TABLE items ADD INDEX category_rand_key (category, rand_key)")
+        self.connection.commit()
+        cursor.close()
+        self._has_rand_key = True
+
+    def _count(self, categories) -> int:
+        return self._fetch(f"SELECT COUNT(*) FROM items WHERE category IN ({', '.join(['%s'] * len(categories))})",
+                           list(categories))[0][0]
+
+    # n independent draws, each one the smallest key after a random point over every category (a range of the
+    # (category, rand_key) index). The seeks of a batch of draws are sent as a single query
+    def _seek_sample(self, categories, n) -> List[str]:
+        sample = {}
+        first = None
+        while len(sample) < n:
+            points = [self.random.random() for _ in range(min(n - len(sample), SEEK_BATCH_SIZE))]
+            query = ' UNION ALL '.join(["(SELECT %s, rand_key, id FROM items WHERE category = %s AND rand_key >= %s "
+                                        "ORDER BY rand_key LIMIT 1)"] * (len(points) * len(categories)))
+            drawn = {}
+            for draw, key, item_id in self._fetch(query, [value for draw, point in enumerate(points)
+                                                          for category in categories
+                                                          for value in (draw, category, point)]):
+                drawn[draw] = min(drawn.get(draw, (key, item_id)), (key, item_id))
+            for draw in range(len(points)):
+                if draw not in drawn:
+                    # No key after the point: the draw wraps around to the first key
+                    first = first or self._first_key(categories)
+                    drawn[draw] = first
+                sample.setdefault(drawn[draw][1], None)
+        return list(sample)
+
+    def _first_key(self, categories) -> tuple:
+        return min(self._fetch(' UNION ALL '.join(["(SELECT rand_key, id FROM items WHERE category = %s "
+                                                   "ORDER BY rand_key LIMIT 1)"] * len(categories)), categories))
+
+    def _reservoir_sample(self, categories, n) -> List[str]:
+        query = f"SELECT id FROM items WHERE category IN ({', '.join(['%s'] * len(categories))})"
+        cursor = self.connection.cursor()
+        cursor.execute(query, list(categories))
+        sample = []
+        seen = 0
+        for (item_id,) in cursor:
+            seen += 1
+            if len(sample) < n:
+                sample.append(item_id)
+            else:
+                # The i-th item replaces a random one of the sample with probability n / i
+                index = self.random.randrange(seen)
+                if index < n:
+                    sample[index] = item_id
+        cursor.close()
+        return sample
+
+    def _fetch(self, query, params) -> List[tuple]:
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
@@ -0,0 +1,210 @@
+from typing import Hashable, Iterable, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse
+
+__all__ = ['incidence_matrix', 'cooccurrence_pairs', 'jaccard_pairs', 'minhash_signatures', 'lsh_candidate_pairs',
+           'similar_pairs', 'neighbour_stats']
+
+# Prime of the MinHash hash functions, small enough for (a * item + b) to fit in 64 bits
+MINHASH_PRIME = (1 << 31) - 1
+
+
+def incidence_matrix(pairs: Iterable[Tuple[Hashable, Hashable]], rows: Sequence[Hashable] = None):
+    """
+    Build the binary user x item incidence matrix of a set of reviews.
+
+    Parameters:
+        pairs (Iterable): (user, item) pairs, repeated pairs count once.
+        rows (Sequence): Users of the rows, in order (default: users in order of appearance).
+
+    Returns:
+        tuple: (csr_matrix, users, items), with the users and items of each row and column.
+    """
+    user_index = {user: i for i, user in enumerate(rows)} if rows is not None else {}
+    item_index = {}
+    row_indices, col_indices = [], []
+    for user, item in pairs:
+        if rows is None:
+            user_index.setdefault(user, len(user_index))
+        elif user not in user_index:
+            continue
+        row_indices.append(user_index[user])
+        col_indices.append(item_index.setdefault(item, len(item_index)))
+    matrix = scipy.sparse.csr_matrix((np.ones(len(row_indices), dtype=np.int32), (row_indices, col_indices)),
+                                     shape=(len(user_index), len(item_index)))
+    # Repeated pairs are summed by the constructor
+    matrix.data[:] = 1
+    return matrix, list(user_index), list(item_index)
+
+
+def cooccurrence_pairs(matrix: scipy.sparse.csr_matrix, block_size: int = 4096):
+    """
+    Number of columns shared by every pair of rows sharing at least one, e.g. the items two users both reviewed.
+
+    Parameters:
+        matrix (csr_matrix): Binary incidence matrix.
+        block_size (int): Number of rows multiplied at once (default: 4096).
+
+    Returns:
+        tuple: (rows, cols, counts) arrays, with rows < cols.
+    """
+    return _concatenate(list(_cooccurrence_blocks(scipy.sparse.csr_matrix(matrix, dtype=np.int32), block_size)))
+
+
+def jaccard_pairs(matrix: scipy.sparse.csr_matrix, min_jaccard: float = 0.0, block_size: int = 4096):
+    """
+    Exact Jaccard similarity of every pair of rows sharing at least one column, from their co-occurrences.
+
+    Parameters:
+        matrix (csr_matrix): Binary incidence matrix.
+        min_jaccard (float): Only pairs with a greater similarity are returned (default: 0).
+        block_size (int): Number of rows multiplied at once (default: 4096).
+
+    Returns:
+        tuple: (rows, cols, jaccard) arrays, with rows < cols.
+    """
+    matrix = scipy.sparse.csr_matrix(matrix, dtype=np.int32)
+    sizes = np.diff(matrix.indptr)
+    results = []
+    for rows, cols, intersection in _cooccurrence_blocks(matrix, block_size):
+        jaccard = intersection / (sizes[rows] + sizes[cols] - intersection)
+        keep = jaccard > min_jaccard
+        results.append((rows[keep], cols[keep], jaccard[keep]))
+    return _concatenate(results)
+
+
+def minhash_signatures(matrix: scipy.sparse.csr_matrix, num_perm: int = 128, seed: int = 0,
+                       chunk_size: int = 16) -> np.ndarray:
+    """
+    MinHash signatures of the rows of an incidence matrix: for each of `num_perm` random hash functions, the minimum
+    hash of the columns of the row. Two rows have the same value in a position with a probability equal to their Jaccard
+    similarity. Empty rows get `MINHASH_PRIME` everywhere.
+
+    Returns:
+        np.ndarray: (rows, num_perm) array.
+    """
+    matrix = scipy.sparse.csr_matrix(matrix)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MINHASH_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, num_perm, dtype=np.uint64)
+    signatures = np.full((matrix.shape[0], num_perm), MINHASH_PRIME, dtype=np.uint64)
+    non_empty = np.flatnonzero(np.diff(matrix.indptr))
+    if not len(non_empty):
+        return signatures
+    columns = matrix.indices.astype(np.uint64)
+    # Hash functions are applied a few at a time, the (non zeros x hashes) array is the largest one built
+    for start in range(0, num_perm, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        hashes = (columns[:, None] * a[None, chunk] + b[None, chunk]) % MINHASH_PRIME
+        signatures[non_empty, chunk] = np.minimum.reduceat(hashes, matrix.indptr[non_empty], axis=0)
+    return signatures
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, rows_per_band: int = 4, max_bucket_size: int = 1000) -> np.ndarray:
+    """
+    Locality sensitive hashing of MinHash signatures: signatures are split in bands and rows with the same values in a
+    band become candidates. Pairs with Jaccard similarity s are found with probability 1 - (1 - s^r)^b, for b bands of r
+    rows.
+
+    Parameters:
+        signatures (np.ndarray): MinHash signatures (see `minhash_signatures`).
+        rows_per_band (int): Values of each band, more means fewer and more similar candidates (default: 4).
+        max_bucket_size (int): Larger buckets are skipped, they are too common to be informative (default: 1000).
+
+    Returns:
+        np.ndarray: (pairs, 2) array of row indices, with the first lower than the second.
+    """
+    num_rows, num_perm = signatures.shape
+    candidates = []
+    for start in range(0, num_perm - rows_per_band + 1, rows_per_band):
+        band = np.ascontiguousarray(signatures[:, start:start + rows_per_band])
+        _, bucket = np.unique(band, axis=0, return_inverse=True)
+        bucket = bucket.ravel()
+        order = np.argsort(bucket, kind='stable')
+        bounds = np.flatnonzero(np.diff(bucket[order])) + 1
+        for members in np.split(order, bounds):
+            if 1 < len(members) <= max_bucket_size:
+                first, second = np.triu_indices(len(members), k=1)
+                candidates.append(np.column_stack([members[first], members[second]]))
+    if not candidates:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(candidates), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def similar_pairs(matrix: scipy.sparse.csr_matrix, method: str = 'exact', min_jaccard: float = 0.0,
+                  num_perm: int = 128, rows_per_band: int = 4, seed: int = 0):
+    """
+    Jaccard similarity of the pairs of rows of an incidence matrix.
+
+    Parameters:
+        matrix (csr_matrix): Binary incidence matrix.
+        method (str): 'exact' for every pair sharing a column, or 'minhash' to only score the candidates found with
+                      MinHash-LSH, which misses some low similarity pairs but scales to many more rows
+                      (default: 'exact').
+        min_jaccard (float): Only pairs with a greater similarity are returned (default: 0).
+        num_perm (int): Number of MinHash hash functions (default: 128).
+        rows_per_band (int): Values of each LSH band (default: 4).
+        seed (int): Seed of the MinHash hash functions (default: 0).
+
+    Returns:
+        tuple: (rows, cols, jaccard) arrays, with rows < cols.
+    """
+    if method == 'exact':
+        return jaccard_pairs(matrix, min_jaccard)
+    if method != 'minhash':
+        raise ValueError("Unknown similarity method. Available methods are ['exact', 'minhash']")
+    matrix = scipy.sparse.csr_matrix(matrix, dtype=np.int32)
+    pairs = lsh_candidate_pairs(minhash_signatures(matrix, num_perm, seed), rows_per_band)
+    rows, cols = pairs[:, 0], pairs[:, 1]
+    # Candidates are scored exactly
+    intersection = np.asarray(matrix[rows].multiply(matrix[cols]).sum(axis=1)).ravel()
+    sizes = np.diff(matrix.indptr)
+    jaccard = intersection / np.maximum(sizes[rows] + sizes[cols] - intersection, 1)
+    keep = jaccard > min_jaccard
+    return rows[keep], cols[keep], jaccard[keep]
+
+
+def neighbour_stats(num_rows: int, rows: np.ndarray, cols: np.ndarray, scores: np.ndarray, k: int = 10):
+    """
+    Number of neighbours of every row and its k most similar neighbours, from the pairs of `similar_pairs`.
+
+    Parameters:
+        num_rows (int): Number of rows of the matrix.
+        rows, cols, scores (np.ndarray): Similar pairs and their similarity.
+        k (int): Number of neighbours kept per row (default: 10).
+
+    Returns:
+        tuple: (counts, neighbours, similarities), with the number of neighbours of each row, and a list with the
+               indices and similarities of the top neighbours of each row, most similar first.
+    """
+    # Each pair is a neighbour of both of its rows
+    source = np.concatenate([rows, cols]).astype(np.int64)
+    target = np.concatenate([cols, rows]).astype(np.int64)
+    similarity = np.concatenate([scores, scores])
+    counts = np.bincount(source, minlength=num_rows)
+    order = np.lexsort((-similarity, source))
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    neighbours, similarities = [], []
+    for row in range(num_rows):
+        top = order[bounds[row]:min(bounds[row] + k, bounds[row + 1])]
+        neighbours.append(target[top])
+        similarities.append(similarity[top])
+    return counts, neighbours, similarities
+
+
+# Co-occurrences come from the sparse product M·Mᵀ, which only enumerates the pairs of rows meeting in some column (the
+# column -> rows inverted index), and only its upper triangle is kept. Rows are processed in blocks to bound the memory
+# of the product
+def _cooccurrence_blocks(matrix: scipy.sparse.csr_matrix, block_size: int):
+    transposed = matrix.T.tocsc()
+    for start in range(0, matrix.shape[0], block_size):
+        product = scipy.sparse.triu(matrix[start:start + block_size] @ transposed, k=1 + start).tocoo()
+        yield product.row + start, product.col, product.data
+
+
+def _concatenate(results):
+    if not results:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(arrays) for arrays in zip(*results))
@@ -0,0 +1,29 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict
+
+__all__ = ['PhaseTimer']
+
+
+class PhaseTimer:
+    """
+    Wall time spent in each phase of a run (e.g. reading MongoDB, computing, writing Neo4j). A phase entered several
+    times adds up.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager timing a phase.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - start
+
+    def total(self) -> float:
+        return sum(self.phases.values())
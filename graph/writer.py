@@ -0,0 +1,254 @@
+from typing import Iterable, Iterator, List, Optional
+import collections
+import re
+
+import neo4j
+
+from graph.graph_data import GraphData
+
+__all__ = ['GraphWriter']
+
+# Labels whose `id` property is unique, the writes match their nodes by it
+CONSTRAINED_LABELS = ('REVIEWER', 'ITEM', 'CATEGORY')
+
+# Properties with a range index, for the lookups and sorts done on them (e.g. the users with the most neighbours)
+INDEXED_PROPERTIES = (('REVIEWER', 'neighbours'),)
+
+# Modes of `GraphWriter.write`
+WRITE_MODES = ('reset', 'sync', 'append')
+
+
+# Hashable form of the properties of a node or relationship, with the values read from Neo4j (temporal types, lists)
+# comparable with the ones of a GraphData
+def _freeze(properties: dict) -> Optional[tuple]:
+    if properties is None:
+        return None
+    # Neo4j doesn't store null properties
+    return tuple(sorted((key, _freeze_value(value)) for key, value in properties.items() if value is not None))
+
+
+def _freeze_value(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(item) for item in value)
+    if hasattr(value, 'to_native'):
+        return value.to_native()
+    return value
+
+
+# Labels and relationship types can't be query parameters, so they are checked before being put in a query
+def _identifier(name: str) -> str:
+    if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', name):
+        raise ValueError(f"Invalid label or relationship type: {name!r}")
+    return name
+
+
+def _schema_queries(labels: Iterable[str] = CONSTRAINED_LABELS) -> List[str]:
+    queries = [f"CREATE CONSTRAINT {_identifier(label).lower()}_id IF NOT EXISTS FOR (n:{label}) REQUIRE n.id IS UNIQUE"
+               for label in labels]
+    queries += [f"CREATE INDEX {_identifier(label).lower()}_{_identifier(name).lower()} IF NOT EXISTS "
+                f"FOR (n:{label}) ON (n.{name})" for label, name in INDEXED_PROPERTIES]
+    return queries
+
+
+def _node_query(label: str, replace: bool = False) -> str:
+    return f"UNWIND $rows AS row MERGE (n:{_identifier(label)} {{id: row.id}}) " \
+           f"SET n {'=' if replace else '+='} row.properties"
+
+
+def _relationship_query(rel_type: str, start_label: str, end_label: str) -> str:
+    return f"UNWIND $rows AS row " \
+           f"MATCH (source:{_identifier(start_label)} {{id: row.start}}) " \
+           f"MATCH (target:{_identifier(end_label)} {{id: row.end}}) " \
+           f"CREATE (source)-[r:{_identifier(rel_type)}]->(target) SET r = row.properties"
+
+
+# Rows of a node label or relationship type, as sent in the `$rows` parameter of the queries
+def _node_rows(nodes: dict) -> Iterator[dict]:
+    return ({'id': node_id, 'properties': properties} for node_id, properties in nodes.items())
+
+
+def _relationship_rows(relationships: Iterable[tuple]) -> Iterator[dict]:
+    return ({'start': start, 'end': end, 'properties': properties} for start, end, properties in relationships)
+
+
+def _batches(rows: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class GraphWriter:
+    """
+    Writes graphs to Neo4j in batches: rows are sent as a list parameter expanded with `UNWIND`, each batch in its own
+    explicit transaction (retried on transient errors by the driver). Nodes are matched through the uniqueness
+    constraints on the `id` of REVIEWER, ITEM and CATEGORY, so relationships never need a label scan.
+
+    Graphs are written in one of these modes:
+        'reset': delete everything, in batches, and write the graph.
+        'sync': compare the graph with the one in the database and only write the differences. Loading a graph close
+                to the previous one (e.g. a section run with a slightly different size) costs reading the database and
+                writing the changes.
+        'append': write the graph on top of the database.
+    """
+
+    def __init__(self, driver: neo4j.Driver, batch_size: int = 10000, database: str = None, mode: str = 'reset'):
+        """
+        Parameters:
+            driver (Driver): The Neo4j driver.
+            batch_size (int): Number of rows written or deleted in each transaction (default: 10000).
+            database (str): Name of the Neo4j database (default: the default database of the server).
+            mode (str): Default mode of `write`, 'reset', 'sync' or 'append' (default: 'reset').
+        """
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode. Available modes are {list(WRITE_MODES)}")
+        self.driver = driver
+        self.batch_size = batch_size
+        self.database = database
+        self.mode = mode
+
+    def ensure_constraints(self, labels: Iterable[str] = CONSTRAINED_LABELS):
+        """
+        Create the uniqueness constraints on the `id` of the given labels, and the indexes of `INDEXED_PROPERTIES`, if
+        they don't exist.
+        """
+        with self.driver.session(database=self.database) as session:
+            for query in _schema_queries(labels):
+                session.run(query).consume()
+
+    def reset(self):
+        """
+        Delete every node and relationship, `batch_size` nodes per transaction so the transaction state stays small.
+        """
+        self._delete_batches("MATCH (n) WITH n LIMIT $batch DETACH DELETE n RETURN count(*)")
+
+    def write(self, graph: GraphData, mode: str = None):
+        """
+        Write a graph: first every node, then every relationship.
+
+        Parameters:
+            graph (GraphData): The graph.
+            mode (str): 'reset', 'sync' or 'append' (default: the mode of the writer).
+        """
+        mode = mode or self.mode
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode. Available modes are {list(WRITE_MODES)}")
+        self.ensure_constraints()
+        if mode == 'sync':
+            self.sync(graph)
+            return
+        if mode == 'reset':
+            self.reset()
+        for label, nodes in graph.nodes.items():
+            self.write_nodes(label, _node_rows(nodes))
+        for (rel_type, start_label, end_label), relationships in graph.relationships.items():
+            self.write_relationships(rel_type, start_label, end_label, _relationship_rows(relationships))
+
+    def sync(self, graph: GraphData):
+        """
+        Make the database hold exactly a graph, only deleting and writing what differs: nodes and relationships that
+        are not in the graph or have other properties are deleted, and the missing ones are written.
+        """
+        with self.driver.session(database=self.database) as session:
+            labels = [record['label'] for record in session.run("CALL db.labels() YIELD label")]
+            rel_types = [record['relationshipType']
+                         for record in session.run("CALL db.relationshipTypes() YIELD relationshipType")]
+
+        # Nodes: labels out of the graph are deleted, then the nodes of each label are compared by id
+        for label in labels:
+            if label not in graph.nodes:
+                self._delete_batches(f"MATCH (n:{_identifier(label)}) WITH n LIMIT $batch DETACH DELETE n "
+                                     f"RETURN count(*)")
+        for label, nodes in graph.nodes.items():
+            existing = dict(self._read(f"MATCH (n:{_identifier(label)}) RETURN n.id, properties(n)"))
+            self._run_batches(f"UNWIND $rows AS id MATCH (n:{_identifier(label)} {{id: id}}) DETACH DELETE n",
+                              (node_id for node_id in existing if node_id not in nodes))
+            changed = [{'id': node_id, 'properties': {**properties, 'id': node_id}}
+                       for node_id, properties in nodes.items()
+                       if _freeze(existing.get(node_id)) != _freeze({**properties, 'id': node_id})]
+            self.write_nodes(label, changed, replace=True)
+
+        # Relationships: types out of the graph are deleted, and so are the ones of a type joining other labels
+        for rel_type in rel_types:
+            endpoints = [(start_label, end_label) for (other_type, start_label, end_label) in graph.relationships
+                         if other_type == rel_type]
+            if not endpoints:
+                condition = ''
+            else:
+                condition = 'WHERE NOT (' + ' OR '.join(f'(source:{_identifier(start_label)} AND '
+                                                        f'target:{_identifier(end_label)})'
+                                                        for start_label, end_label in endpoints) + ') '
+            self._delete_batches(f"MATCH (source)-[r:{_identifier(rel_type)}]->(target) {condition}"
+                                 f"WITH r LIMIT $batch DELETE r RETURN count(*)")
+
+        # Then the relationships of each type and labels are compared as multisets of (start, end, properties)
+        for (rel_type, start_label, end_label), relationships in graph.relationships.items():
+            missing = collections.Counter((start, end, _freeze(properties)) for start, end, properties in relationships)
+            stale = []
+            for start, end, properties, element_id in self._read(
+                    f"MATCH (source:{_identifier(start_label)})-[r:{_identifier(rel_type)}]->"
+                    f"(target:{_identifier(end_label)}) RETURN source.id, target.id, properties(r), elementId(r)"):
+                key = (start, end, _freeze(properties))
+                if missing[key] > 0:
+                    missing[key] -= 1
+                else:
+                    stale.append(element_id)
+            self._run_batches("UNWIND $rows AS id MATCH ()-[r]->() WHERE elementId(r) = id DELETE r", stale)
+            self.write_relationships(rel_type, start_label, end_label,
+                                     _relationship_rows((start, end, dict(properties))
+                                                        for (start, end, properties), count in missing.items()
+                                                        for _ in range(count)))
+
+    def write_nodes(self, label: str, rows: Iterable[dict], replace: bool = False):
+        """
+        Create or update nodes.
+
+        Parameters:
+            label (str): Label of the nodes.
+            rows (Iterable): {'id': ..., 'properties': {...}} of each node.
+            replace (bool): Whether the properties of existing nodes are replaced instead of updated (default: False).
+        """
+        self._run_batches(_node_query(label, replace), rows)
+
+    def write_relationships(self, rel_type: str, start_label: str, end_label: str, rows: Iterable[dict]):
+        """
+        Create relationships between existing nodes.
+
+        Parameters:
+            rel_type (str): Type of the relationships.
+            start_label (str): Label of the start nodes.
+            end_label (str): Label of the end nodes.
+            rows (Iterable): {'start': id, 'end': id, 'properties': {...}} of each relationship.
+        """
+        self._run_batches(_relationship_query(rel_type, start_label, end_label), rows)
+
+    def _run_batches(self, query: str, rows: Iterable[dict]):
+        with self.driver.session(database=self.database) as session:
+            for batch in _batches(rows, self.batch_size):
+                session.execute_write(self._run_batch, query, batch)
+
+    # Run a deletion returning the number of deleted elements until nothing is left
+    def _delete_batches(self, query: str):
+        with self.driver.session(database=self.database) as session:
+            while session.execute_write(self._run_count, query, self.batch_size):
+                pass
+
+    def _read(self, query: str) -> List[list]:
+        with self.driver.session(database=self.database) as session:
+            return session.execute_read(self._run_values, query)
+
+    @staticmethod
+    def _run_batch(tx: neo4j.ManagedTransaction, query: str, batch: List[dict]):
+        tx.run(query, rows=batch).consume()
+
+    @staticmethod
+    def _run_count(tx: neo4j.ManagedTransaction, query: str, batch_size: int) -> int:
+        return tx.run(query, batch=batch_size).single()[0]
+
+    @staticmethod
+    def _run_values(tx: neo4j.ManagedTransaction, query: str) -> List[list]:
+        return tx.run(query).values()
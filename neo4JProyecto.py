@@ -1,4 +1,17 @@
+from functools import partial
+import argparse
+import configparser
+import shlex
+
 from utils.database import connect_to_neo4j, connect_to_mongodb, connect_to_mysql
+from graph.async_writer import ASYNC_WRITE_MODES, AsyncGraphWriter
+from graph.bulk_import import BulkImportWriter
+from graph.data_access import item_reviews, popular_items_reviewers, top_reviewers_items, user_category_counts
+from graph.graph_data import GraphData
+from graph.sampling import ItemSampler
+from graph.similarity import cooccurrence_pairs, incidence_matrix, neighbour_stats, similar_pairs
+from graph.timing import PhaseTimer
+from graph.writer import GraphWriter
 
 
 NEO_DRIVER = connect_to_neo4j()
@@ -12,6 +25,40 @@ MYSLQ_CONN.database = nom_bd
 nom_coll = 'reviews'
 collection = MONGO_CLIENT[nom_bd][nom_coll]
 
+# Writer of the graphs: rows per transaction, and whether the database is emptied first ('reset'), only changed where
+# it differs from the new graph ('sync') or written on top ('append'). With a concurrency above 1, transactions are
+# run at once with the async driver, which only resets or appends: graphs are still synced one transaction at a time
+config = configparser.ConfigParser()
+config.read('config.ini')
+write_mode = config.get('Graph', 'write_mode', fallback='sync')
+if config.getint('Graph', 'concurrency', fallback=1) > 1 and write_mode in ASYNC_WRITE_MODES:
+    GRAPH_WRITER = AsyncGraphWriter(batch_size=config.getint('Graph', 'batch_size', fallback=10000),
+                                    concurrency=config.getint('Graph', 'concurrency'), mode=write_mode)
+else:
+    GRAPH_WRITER = GraphWriter(NEO_DRIVER, batch_size=config.getint('Graph', 'batch_size', fallback=10000),
+                               mode=write_mode)
+
+def load_graph(graph: GraphData, writer=None) -> bool:
+    '''
+    Will write a graph to neo4j, or export it to the files of the offline importer
+
+    Parameters:
+        graph: the graph
+        writer: GraphWriter, AsyncGraphWriter or BulkImportWriter (default: GRAPH_WRITER)
+
+    Returns:
+        whether the graph was loaded into neo4j
+    '''
+    writer = writer or GRAPH_WRITER
+    if isinstance(writer, BulkImportWriter):
+        command = writer.write(graph)
+        print('Graph exported. Stop neo4j and import it with:\n' + ' '.join(shlex.quote(arg) for arg in command))
+        print('Then start neo4j and create its constraints and indexes with:\n'
+              f'cypher-shell -f {shlex.quote(writer.schema_path)}')
+        return False
+    writer.write(graph)
+    return True
+
 
 def take_a_number(message: str)-> int:
     '''
@@ -29,83 +76,67 @@ def take_a_number(message: str)-> int:
     return num
 
 
-def section_1():
+def section_1(n_users: int = None, method: str = 'exact', top_k: int = 10, writer=None,
+              timer: PhaseTimer = None):
     '''
     Will perform section 2 of neo4j
 
+    Parameters:
+        n_users: number of users to analyze (default: asked from keyboard)
+        method: 'exact' Jaccard similarity, or approximate 'minhash' for tens of thousands of users
+        top_k: number of most similar users stored in each user (default: 10)
+        writer: writer of the graph, see load_graph (default: GRAPH_WRITER)
+        timer: timer of the phases of the section (default: not timed)
+
     Returns:
         user with the most relationships
     '''
+    timer = timer or PhaseTimer()
     # We ask for the number of users
-    n_users = take_a_number('Enter number of users to analyze: ')
-    # We will define the Jaccard similarity
-
-    def jaccard_similarity(set1, set2):
-        '''
-        Calculates the Jaccard similarity for two sets
-
-        '''
-        intersection = set1.intersection(set2)
-        union = set1.union(set2)
-        return len(intersection) / len(union)
-
-    # And a query to clean the DB
-    delete_query = "MATCH (n) DETACH DELETE n"
-
-    # To obtain the users, we must connect to MongoDB
-    r = list(collection.aggregate([
-        {'$group': {'_id': '$reviewer_id', 'rev_amount': {'$sum': 1}}},
-        {'$sort': {'rev_amount': -1}},
-        {'$project': {'rev_amount': 0}},
-        {'$limit': n_users}
-        ]
-    ))
-
-    # Now, for each user, let's see which items they have rated
-    # We will save everything in a dictionary, with key -> user, value -> set with voted items
-    # At the same time, we will calculate the similarity of the current user with that of the previous ones
-    # If there is similarity, we will save a tuple (user1, user2, similarity)
-    users = {}
-    similarity = []
-    for user in r:
-        user = user['_id']
-        items = list(collection.find({'reviewer_id': user}, {'item_id': 1, '_id': 0}))
-        items = set(art.get('item_id') for art in items)
-
-        for user_2, set_2 in users.items():
-            jaccard = jaccard_similarity(items, set_2)
-            if jaccard:
-                similarity.append((user, user_2, round(jaccard, 4)))
-        # Finally, we add the current user
-        users[user] = items
-
-    # Let's start with the neo4j queries
-    users_query = """
-                       CREATE (n:REVIEWER {id: $id}) RETURN n;
-                       """
-
-    similarity_query = """
-                         MATCH (user_1:REVIEWER {id: $id_user_1} ),
-                         (user_2:REVIEWER {id: $id_user_2})
-                         CREATE (user_1) - [:SIMILAR_TO {jaccard: $jaccard}] -> (user_2)
-                         CREATE (user_2) - [:SIMILAR_TO {jaccard: $jaccard}] -> (user_1)
-                         """
+    if n_users is None:
+        n_users = take_a_number('Enter number of users to analyze: ')
+
+    # To obtain the users and the items each of them rated, we must connect to MongoDB
+    with timer.phase('mongo_fetch'):
+        user_items = top_reviewers_items(collection, n_users)
+
+    with timer.phase('compute'):
+        # We build a sparse user x item matrix, and the Jaccard similarity of every pair of users sharing an item
+        # If there is similarity, we will save a tuple (user1, user2, similarity), user1 being the one with fewer
+        # reviews
+        matrix, users, _ = incidence_matrix(((user, item) for user, items in user_items.items() for item in items),
+                                            rows=list(user_items))
+        rows, cols, scores = similar_pairs(matrix, method=method)
+        similarity = [(users[col], users[row], round(float(jaccard), 4))
+                      for row, col, jaccard in zip(rows, cols, scores)]
+        # Each user keeps its number of neighbours and its most similar users, so they are read without going through
+        # the relations
+        counts, neighbours, similarities = neighbour_stats(len(users), rows, cols, scores, k=top_k)
+
+        # Let's build the graph: users, and a single relation for every similar pair (it is symmetric)
+        graph = GraphData()
+        for i, user in enumerate(users):
+            graph.add_node('REVIEWER', user, neighbours=int(counts[i]),
+                           top_neighbours=[users[j] for j in neighbours[i]],
+                           top_jaccard=[round(float(jaccard), 4) for jaccard in similarities[i]])
+        for user_1, user_2, jaccard in similarity:
+            graph.add_relationship('SIMILAR_TO', 'REVIEWER', user_1, 'REVIEWER', user_2, jaccard=jaccard)
 
+    # The neighbours property is indexed, so the user with most neighbours is the first entry of the index
     neigh_query = """
-                       MATCH (u:REVIEWER)-[r:SIMILAR_TO]->(:REVIEWER)
-                       RETURN u, count(r) as similars
-                       ORDER BY similars DESC
+                       MATCH (u:REVIEWER)
+                       WHERE u.neighbours IS NOT NULL
+                       RETURN u, u.neighbours as similars
+                       ORDER BY u.neighbours DESC
                        LIMIT 1
                        """
 
-    with NEO_DRIVER.session() as session:
-        session.run(delete_query)
-        # We create users
-        for user in users.keys():
-            session.run(users_query, id=user)
-        # We create relations
-        for user_1, user_2, jaccard in similarity:
-            session.run(similarity_query, id_user_1=user_1, id_user_2=user_2, jaccard=jaccard)
+    # We load the graph in batches
+    with timer.phase('neo4j_write'):
+        loaded = load_graph(graph, writer)
+    if not loaded:
+        return None
+    with timer.phase('read_query'), NEO_DRIVER.session() as session:
         # We search the user with most neighbours
         most_neigh = session.run(neigh_query)
         data = most_neigh.data()[0]
@@ -113,24 +144,33 @@ def section_1():
     message = f"Data loaded.\nThe user with most neighbours is user \
 '{data['u']['id']}', which has {data['similars']} neighbours"
     print(message)
+    top = ', '.join(f"'{user}' ({jaccard})" for user, jaccard in zip(data['u']['top_neighbours'],
+                                                                     data['u']['top_jaccard']))
+    print(f'Its most similar users are {top}')
     return data
 
 
-def section_2():
+def section_2(n: int = None, categories: list = None, writer=None, sampler: ItemSampler = None,
+              timer: PhaseTimer = None):
     '''
     Will perform section 2 of neo4j
+
+    Parameters:
+        n: number of aleatory items (default: asked from keyboard)
+        categories: categories of the items (default: asked from keyboard)
+        writer: writer of the graph, see load_graph (default: GRAPH_WRITER)
+        sampler: sampler of the items (default: random samples of MYSLQ_CONN)
+        timer: timer of the phases of the section (default: not timed)
     '''
-    def take_categories(cursor, ab_cat=False):
+    timer = timer or PhaseTimer()
+    sampler = sampler or ItemSampler(MYSLQ_CONN)
+
+    def take_categories(ab_cat=False):
         '''
         Will show actual categories from the database, and will ask for some of them
         '''
         if not ab_cat:
-            categories_query = '''
-                            SELECT DISTINCT category
-                            FROM items 
-                            '''
-            cursor.execute(categories_query)
-            ab_cat = list(d[0] for d in cursor.fetchall())
+            ab_cat = sampler.categories()
 
         print('\nAvailable categories are: ')
         for i in range(len(ab_cat)):
@@ -144,273 +184,146 @@ for example "1-4"\n'
             categories = [ab_cat[i - 1] for i in categories]
         except (ValueError, IndexError):
             print('\nIncorrect type or category')
-            return take_categories(cursor, ab_cat)
+            return take_categories(ab_cat)
 
         return categories
 
-    n = take_a_number('Enter the number of aleatory items to get: ')
-    cursor = MYSLQ_CONN.cursor()
-    categories = take_categories(cursor)
-    sql_query = '''
-            SELECT id
-            FROM items
-            WHERE category IN ({})
-            ORDER BY RAND()
-            LIMIT {}
-            '''.format(','.join(['%s'] * len(categories)), n)
-    cursor.execute(sql_query, categories)
-    items = cursor.fetchall()
-    cursor.close()
-
-    # Once we have the items, let's collect which users have reviewed them
+    if n is None:
+        n = take_a_number('Enter the number of aleatory items to get: ')
+    if categories is None:
+        categories = take_categories()
+    with timer.phase('mysql_fetch'):
+        items = sampler.sample(categories, n)
+
+    # Once we have the items, let's collect which users have reviewed them, all in a single query
     # We will save this in a dictionary art:{reviewers: [], overall: [], reviewTime: []},
     # as well as a set with users
-    reviews = {}
-    users = set()
-    for art in items:
-        art = art[0]
-        # We look for the users
-        r  = list(collection.find({'item_id': art}, {'reviewer_id': 1, 'overall': 1, 'reviewTime':1,  '_id':0}))
-        user = list(user.get('reviewer_id') for user in r)
-        users.update(user)
-        reviews[art] = {
-                        'reviewers': user,
-                        'overall': list(user.get('overall') for user in r),
-                        'reviewTime': list(user.get('reviewTime') for user in r)
-                        }
+    with timer.phase('mongo_fetch'):
+        reviews = item_reviews(collection, items)
 
     # Once we have the structure, we can add it to neo4j
-    # query to clean the database
-    delete_query = "MATCH (n) DETACH DELETE n"
-
-    item_query = """
-                    CREATE (n:ITEM {id: $id}) RETURN n;
-                    """
-    users_query = """
-                       CREATE (n:REVIEWER {id: $id}) RETURN n;
-                       """
-
-    reviews_query = """
-                       MATCH (user:REVIEWER {
-                           id: $user_id
-                       }), (item:ITEM {
-                           id: $item_id
-                       })
-                       CREATE (user)-[:REVIEWED {
-                           overall: $overall,
-                           reviewTime: $reviewTime
-                       }]->(item)
-                       """
-
-    with NEO_DRIVER.session() as session:
-        # We clean the database
-        session.run(delete_query)
-        # We add the items
-        for art in items:
-            art = art[0]
-            session.run(item_query, {'id': art})
-        # We add the users
-        for user in users:
-            session.run(users_query, {'id': user})
-        # We add the reviews
+    with timer.phase('compute'):
+        users = set(user for art in reviews.values() for user in art['reviewers'])
+        graph = GraphData()
+        graph.add_nodes('ITEM', items)
+        graph.add_nodes('REVIEWER', users)
         for art in reviews:
             for i in range(len(reviews[art]['reviewers'])):
-                session.run(reviews_query, {
-                    'user_id': reviews[art]['reviewers'][i],
-                    'item_id': art,
-                    'overall': reviews[art]['overall'][i],
-                    'reviewTime': reviews[art]['reviewTime'][i]
-                })
+                graph.add_relationship('REVIEWED', 'REVIEWER', reviews[art]['reviewers'][i], 'ITEM', art,
+                                       overall=reviews[art]['overall'][i], reviewTime=reviews[art]['reviewTime'][i])
+
+    # We load the graph in batches
+    with timer.phase('neo4j_write'):
+        load_graph(graph, writer)
 
     print('Data loaded correctly')
     return
 
 
-def section_3():
+def section_3(n_users: int = None, writer=None, timer: PhaseTimer = None):
     '''
     Will perform section 3 of neo4j
+
+    Parameters:
+        n_users: number of users to select (default: asked from keyboard)
+        writer: writer of the graph, see load_graph (default: GRAPH_WRITER)
+        timer: timer of the phases of the section (default: not timed)
     '''
+    timer = timer or PhaseTimer()
     # First, we will have to collect the users from mysql
-    n_users = take_a_number('Enter the number of users to select: ')
-    sql_users = f'''
+    if n_users is None:
+        n_users = take_a_number('Enter the number of users to select: ')
+    sql_users = '''
                     SELECT id
                     FROM users
                     ORDER BY ISNULL(reviewerName), reviewerName
-                    LIMIT {n_users}
+                    LIMIT %s
                     '''
-    
-    cursor = MYSLQ_CONN.cursor()
-    cursor.execute(sql_users)
-    users = list(d[0] for d in cursor.fetchall())
-    cursor.close()
+
+    with timer.phase('mysql_fetch'):
+        cursor = MYSLQ_CONN.cursor()
+        cursor.execute(sql_users, (n_users,))
+        users = list(d[0] for d in cursor.fetchall())
+        cursor.close()
 
     # For each user, we'll se how many reviews of each category has
-    r = list(collection.aggregate([
-                {'$match': {'reviewer_id': {'$in': users}}},
-                {'$group':{'_id': {'user': '$reviewer_id', 'category': '$category'}, 'count': {'$sum': 1}}},
-                {'$group':{
-                            '_id': '$_id.user', 'categories': {'$push': {'name': '$_id.category', 'count': '$count'}},
-                           'num_categories': {'$sum': 1}}
-                        },
-                {'$match': {'num_categories': {'$gte': 2}}},
-                {'$sort': {'_id': 1}}
-            ]))
-
-    # And now we process the information in a convenient way
-
-    total_categories = set()
     # Will follow the structure user: {categories: [], count: []}
-    user_categories = {}
-    for user in r:
-        cat = []
-        count = []
-        user_id = user.get('_id')
-        categories = user.get('categories')
-        for categoria in categories:
-            tmp = categoria.get('name')
-            total_categories.add(tmp)
-            cat.append(tmp)
-            count.append(categoria.get('count'))
-        user_categories[user_id] = {'categories': cat, 'count': count}
+    with timer.phase('mongo_fetch'):
+        user_categories = user_category_counts(collection, users)
 
     # Once we have the structure, we can add it to neo4j
-    delete_query = "MATCH (n) DETACH DELETE n"          # query to clean the DB
-
-    category_query = """
-                        CREATE (n:CATEGORY {id: $id}) RETURN n;
-                        """
-    users_query = """
-                       CREATE (n:REVIEWER {id: $id}) RETURN n;
-                       """
-
-    reviews_query = """
-                       MATCH (user:REVIEWER {id: $id_user} ),
-                       (cat:CATEGORY {id: $id_cat})
-                       CREATE (user) - [:REVIEWED {times: $times}] -> (cat)
-                       """
-
-    with NEO_DRIVER.session() as session:
-        session.run(delete_query)
-        # We create items and users
-        for category in total_categories:
-            session.run(category_query, id=category)
-        for user in user_categories.keys():
-            session.run(users_query, id=user)
-        # We create relations
+    with timer.phase('compute'):
+        total_categories = set(category for info in user_categories.values() for category in info['categories'])
+        graph = GraphData()
+        graph.add_nodes('CATEGORY', total_categories)
+        graph.add_nodes('REVIEWER', user_categories.keys())
         for user, info in user_categories.items():
             for i in range(len(info['categories'])):
-                session.run(
-                            reviews_query,
-                            id_user=user,
-                            id_cat=info['categories'][i],
-                            times=info['count'][i]
-                        )
+                graph.add_relationship('REVIEWED', 'REVIEWER', user, 'CATEGORY', info['categories'][i],
+                                       times=info['count'][i])
+
+    # We load the graph in batches
+    with timer.phase('neo4j_write'):
+        load_graph(graph, writer)
 
     print('Data loaded correctly')
     return
 
 
-def section_4():
+def section_4(n_items: int = None, writer=None, timer: PhaseTimer = None):
     '''
     Will perform section 4 of neo4j
+
+    Parameters:
+        n_items: number of items to select (default: asked from keyboard)
+        writer: writer of the graph, see load_graph (default: GRAPH_WRITER)
+        timer: timer of the phases of the section (default: not timed)
     '''
-    n_items = take_a_number('Enter the number of items to select: ')
+    timer = timer or PhaseTimer()
+    if n_items is None:
+        n_items = take_a_number('Enter the number of items to select: ')
     # Let's see which items are the most popular meeting the requirements
-
-    pop_items = list(collection.aggregate([
-                {'$group':{'_id': '$item_id', 'count': {'$sum': 1}}},
-                {'$match': {'count': {'$lt': 40}}},
-                {'$sort': {'count': -1}},
-                {'$limit': n_items}
-            ]))
-    pop_items = [item['_id'] for item in pop_items]
-
-    # Now we will collect all the users who have voted for any of these
-    item_usr = {}
-    total_usr = set()
-    for item in pop_items:
-        users = list(collection.find({'item_id': {'$in': [item]}}, {'reviewer_id': 1, '_id': 0}))
-        users = [user['reviewer_id'] for user in users]
-        item_usr[item] = users
-        total_usr.update(users)
-
-    # Let's analyze relationships
-    # We create a dictionary to store the elements voted by each user
-    usr_items = {user: set() for user in total_usr}
-
-    # We go through the item_usr dictionary and add each element to its respective set of users
-
-    raw_usr_items = list(collection.aggregate([
-                            {'$match': {'reviewer_id': {'$in': list(total_usr)}}},
-                            {'$group': {'_id': {'user': '$reviewer_id', 'item': '$item_id'}}}
-                        ]))
-
-    for element in raw_usr_items:
-        user = element['_id']['user']
-        item = element['_id']['item']
-        usr_items[user].add(item)
-
-    # We will store the relationships in the form (user_1, user_2, common)
-    common_items = []
-
-    # We compare the voted elements
-    for user_1 in total_usr:
-        for user_2 in total_usr:
-            if user_1 != user_2:
-                common = usr_items[user_1].intersection(usr_items[user_2])
-                # If they exist, we'll save them
-                if common:
-                    common_items.append((user_1, user_2, len(common)))
-
-    # Once we have the structure, we can add it to neo4j
-    # query to clean the DB
-    delete_query = "MATCH (n) DETACH DELETE n"
-
-    consulta_item = """
-                    CREATE (n:ITEM {id: $id}) RETURN n;
-                    """
-    users_query = """
-                       CREATE (n:REVIEWER {id: $id}) RETURN n;
-                       """
-
-    reviews_query = """
-                       MATCH (user:REVIEWER {id: $id_user}),
-                       (item:ITEM {id: $id_item})
-                       CREATE (user) - [:REVIEWED] -> (item)
-                       """
-    common_query = """
-                     MATCH (user_1: REVIEWER {id: $id_user_1}),
-                     (user_2: REVIEWER {id: $id_user_2})
-                     CREATE (user_1) - [:COMMON {cantidad: $cantidad}] -> (user_2)
-                     """
-
-    with NEO_DRIVER.session() as session:
-        session.run(delete_query)
-        # We create items and users
-        for item in pop_items:
-            session.run(consulta_item, id=item)
-        for user in total_usr:
-            session.run(users_query, id=user)
-        # We create relations
+    # With them, we collect the users who have voted for each of these items, and the items voted by each user
+    with timer.phase('mongo_fetch'):
+        item_usr, usr_items = popular_items_reviewers(collection, n_items)
+
+    with timer.phase('compute'):
+        pop_items = list(item_usr)
+        total_usr = set(usr_items)
+
+        # Let's analyze relationships: the items in common of every pair of users come from the sparse product of the
+        # user x item matrix and its transpose, each pair once. We store them in the form (user_1, user_2, common)
+        matrix, users, _ = incidence_matrix((user, item) for user, items in usr_items.items() for item in items)
+        rows, cols, counts = cooccurrence_pairs(matrix)
+        common_items = [(users[row], users[col], int(common)) for row, col, common in zip(rows, cols, counts)]
+
+        # Once we have the structure, we can add it to neo4j
+        graph = GraphData()
+        graph.add_nodes('ITEM', pop_items)
+        graph.add_nodes('REVIEWER', total_usr)
         for item, users in item_usr.items():
             for user in users:
-                session.run(
-                            reviews_query,
-                            id_user=user,
-                            id_item=item,
-                        )
+                graph.add_relationship('REVIEWED', 'REVIEWER', user, 'ITEM', item)
         for user_1, user_2, cant in common_items:
-            session.run(common_query, id_user_1=user_1, id_user_2=user_2, cantidad=cant)
+            graph.add_relationship('COMMON', 'REVIEWER', user_1, 'REVIEWER', user_2, cantidad=cant)
+
+    # We load the graph in batches
+    with timer.phase('neo4j_write'):
+        load_graph(graph, writer)
 
     print('Data loaded correctly')
     return
 
 
-def menu():
+def menu(writer=None):
     '''
     Interactive menu for users to choose the section they want to execute
+
+    Parameters:
+        writer: writer of the graphs, see load_graph (default: GRAPH_WRITER)
     '''
-    sections = {'1': section_1, '2': section_2, '3': section_3, '4': section_4, '5': exit}
+    sections = {'1': partial(section_1, writer=writer), '2': partial(section_2, writer=writer),
+                '3': partial(section_3, writer=writer), '4': partial(section_4, writer=writer), '5': exit}
 
     print('Welcome to neo4J proyect. You can choose a section to be executed.')
     print("If needed, you'll be asked for some inputs")
@@ -432,4 +345,17 @@ def menu():
 
 
 if __name__ == '__main__':
-    menu()
+    parser = argparse.ArgumentParser(description='Load the graphs of the reviews into neo4j')
+    parser.add_argument('--export', metavar='DIR',
+                        help='write the graphs as CSV files of the offline importer (neo4j-admin) instead')
+    parser.add_argument('--export-workers', type=int, default=4, help='number of processes writing CSV files')
+    parser.add_argument('--compress', action='store_true', help='compress the CSV files with gzip')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='let the importer replace the existing database (it is wiped)')
+    parser.add_argument('--add-rand-key', action='store_true',
+                        help='add the random keys used to sample the items to a database loaded without them, and exit')
+    args = parser.parse_args()
+    if args.add_rand_key:
+        ItemSampler(MYSLQ_CONN).add_rand_key()
+        parser.exit()
+    menu(BulkImportWriter(args.export, args.export_workers, args.compress, args.overwrite) if args.export else None)
@@ -0,0 +1,43 @@
+from graph.data_access import popular_items_reviewers, top_reviewers_items
+
+
+# Collection recording the pipelines it runs and returning canned documents
+class RecordingCollection:
+
+    def __init__(self, documents):
+        self.name = 'reviews'
+        self.documents = documents
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return iter(self.documents)
+
+
+# Every lookup of a pipeline only brings the fields it needs, not whole reviews
+def assert_lookups_projected(pipeline, fields):
+    lookups = [stage['$lookup'] for stage in pipeline if '$lookup' in stage]
+    assert lookups
+    for lookup in lookups:
+        assert lookup['pipeline'] == [{'$project': {'_id': 0, fields.pop(0): 1}}]
+    assert not fields
+
+
+def test_top_reviewers_items():
+    collection = RecordingCollection([{'_id': 'u1', 'items': ['i1', 'i2']}, {'_id': 'u2', 'items': []}])
+    assert top_reviewers_items(collection, 2) == {'u1': ['i1', 'i2'], 'u2': []}
+    assert {'$limit': 2} in collection.pipelines[0]
+    assert_lookups_projected(collection.pipelines[0], ['item_id'])
+
+
+def test_popular_items_reviewers():
+    collection = RecordingCollection([{'_id': 'u1', 'popular_items': ['i1'], 'items': ['i1', 'i2']},
+                                      {'_id': 'u2', 'popular_items': ['i1', 'i3'], 'items': ['i1', 'i3']}])
+    item_users, user_items = popular_items_reviewers(collection, 2)
+    assert item_users == {'i1': ['u1', 'u2'], 'i3': ['u2']}
+    assert user_items == {'u1': ['i1', 'i2'], 'u2': ['i1', 'i3']}
+    assert_lookups_projected(collection.pipelines[0], ['reviewer_id', 'item_id'])
+
+
+def test_popular_items_reviewers_without_items():
+    assert popular_items_reviewers(RecordingCollection([]), 5) == ({}, {})
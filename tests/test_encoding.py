@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import app.encoding
+from app.encoding import pack_arrays, unpack_array
+
+
+@pytest.fixture(autouse=True)
+def typed_arrays(monkeypatch):
+    monkeypatch.setattr(app.encoding, 'TYPED_ARRAYS', True)
+
+
+def test_integers_use_the_smallest_dtype():
+    figure = pack_arrays({'data': [{'x': list(range(100)), 'y': [-1] + [70000] * 99}]})
+    assert figure['data'][0]['x']['dtype'] == 'u1'
+    assert figure['data'][0]['y']['dtype'] == 'i4'
+    np.testing.assert_array_equal(unpack_array(figure['data'][0]['x']), np.arange(100))
+    np.testing.assert_array_equal(unpack_array(figure['data'][0]['y']), [-1] + [70000] * 99)
+
+
+def test_missing_values_are_nan():
+    values = [0.5, None] * 40
+    packed = pack_arrays({'data': [{'x': values}]})['data'][0]['x']
+    assert packed['dtype'] == 'f8'
+    np.testing.assert_array_equal(unpack_array(packed), [0.5, np.nan] * 40)
+
+
+def test_only_long_numeric_arrays_are_packed():
+    trace = {'x': [1, 2, 3], 'text': ['a'] * 100, 'marker': {'color': [True] * 100}, 'z': [[1.0] * 100] * 100}
+    layout = {'xaxis': {'tickvals': list(range(100))}}
+    figure = pack_arrays({'data': [trace], 'layout': layout})
+    assert figure['data'][0]['x'] == [1, 2, 3]
+    assert figure['data'][0]['text'] == ['a'] * 100
+    assert figure['data'][0]['marker']['color'] == [True] * 100
+    # Rows of a 2D array are packed one by one
+    assert all(row['dtype'] == 'f8' for row in figure['data'][0]['z'])
+    assert figure['layout'] is layout
+
+
+def test_empty_figure():
+    assert pack_arrays({}) == {'data': []}
+    assert pack_arrays({'data': [{'x': []}]}) == {'data': [{'x': []}]}
+    assert unpack_array([]).size == 0
+
+
+def test_figures_are_left_as_is_without_typed_arrays(monkeypatch):
+    monkeypatch.setattr(app.encoding, 'TYPED_ARRAYS', False)
+    figure = {'data': [{'x': list(range(100))}]}
+    assert pack_arrays(figure) is figure
+    np.testing.assert_array_equal(unpack_array(figure['data'][0]['x']), np.arange(100))
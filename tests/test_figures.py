@@ -0,0 +1,62 @@
+import numpy as np
+import plotly.graph_objs as go
+import pytest
+
+from app.figures import _edge_trace, _lttb, _user_reviews
+
+
+def test_lttb_keeps_short_series():
+    np.testing.assert_array_equal(_lttb(np.arange(5), np.arange(5), 10), np.arange(5))
+    np.testing.assert_array_equal(_lttb(np.arange(5), np.arange(5), 2), np.arange(5))
+    assert len(_lttb(np.empty(0), np.empty(0), 100)) == 0
+
+
+@pytest.mark.parametrize('threshold', [3, 10, 99])
+def test_lttb_indices(threshold):
+    rng = np.random.default_rng(0)
+    x = np.arange(1000)
+    y = np.cumsum(rng.integers(0, 5, 1000))
+    keep = _lttb(x, y, threshold)
+    assert len(keep) == threshold
+    # Increasing indices, from the first point to the last one
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert (np.diff(keep) > 0).all()
+
+
+def test_lttb_keeps_peaks():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[[250, 500, 750]] = [10, -10, 10]
+    assert {250, 500, 750}.issubset(_lttb(x, y, 20))
+
+
+# Collection returning canned reviews to `find`, and recording the filter and projection
+class FindCollection:
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = []
+
+    def find(self, query, projection):
+        self.calls.append((query, projection))
+        return iter(self.documents)
+
+
+def test_user_reviews_is_one_projected_query():
+    collection = FindCollection([{'reviewer_id': 'u1', 'item_id': 'i1'}, {'reviewer_id': 'u2', 'item_id': 'i1'}])
+    assert _user_reviews(collection, ('u1', 'u2')) == (['u1', 'u2'], ['i1', 'i1'])
+    assert collection.calls == [({'reviewer_id': {'$in': ['u1', 'u2']}}, {'reviewer_id': 1, 'item_id': 1, '_id': 0})]
+    assert _user_reviews(FindCollection([]), None) == ([], [])
+
+
+def test_edge_trace_segments():
+    coords = np.array([[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]])
+    trace = _edge_trace(go.Scatter, coords, np.array([[0, 2], [1, 2]]))
+    # Each edge goes from its first node to its second one, followed by a gap
+    np.testing.assert_array_equal(trace.x, [0.0, 4.0, np.nan, 2.0, 4.0, np.nan])
+    np.testing.assert_array_equal(trace.y, [1.0, 5.0, np.nan, 3.0, 5.0, np.nan])
+
+
+def test_edge_trace_without_edges():
+    trace = _edge_trace(go.Scatter, np.zeros((2, 2)), np.empty((0, 2), dtype=np.int64))
+    assert len(trace.x) == len(trace.y) == 0
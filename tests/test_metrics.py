@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+import json
+import re
+import time
+
+from dash import Dash, DiskcacheManager, Input, Output, dcc, html
+import diskcache
+import pytest
+
+from app.metrics import _CommandTimer, install_metrics, timed_background_callback
+
+
+# Context with what the metrics read from it
+def fake_context(shared_cache):
+    stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'hit_rate': 0.0, 'memory_bytes': 0}
+    search = SimpleNamespace(table='items', in_use=0)
+    return SimpleNamespace(shared_cache=shared_cache, figure_cache=SimpleNamespace(stats=lambda: stats),
+                           mysql_pool_size=1, item_search=search, user_search=search)
+
+
+def sample(metrics: str, name: str, **labels) -> float:
+    label_pattern = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf'^{name}{{{label_pattern}}} (\S+)$', metrics, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+@pytest.fixture
+def app(tmp_path):
+    shared_cache = diskcache.Cache(str(tmp_path / 'shared'))
+    app = Dash(__name__)
+    app.layout = html.Div([dcc.Input(id='value'), html.Div(id='result')])
+
+    @app.callback(Output('result', 'children'), Input('value', 'value'), background=True,
+                  manager=DiskcacheManager(diskcache.Cache(str(tmp_path / 'background'))))
+    @timed_background_callback(shared_cache, 'result.children')
+    def slow(value):
+        # A MongoDB command of 0.2 s, as reported to the listener, then some computation
+        time.sleep(0.2)
+        _CommandTimer().succeeded(SimpleNamespace(duration_micros=200000, command_name='find'))
+        time.sleep(0.1)
+        return value
+
+    install_metrics(app, fake_context(shared_cache))
+    return app
+
+
+# Run a background callback the way the browser does: a request starting the job, then polls until its result
+def run_background_callback(client, value):
+    body = {'output': 'result.children', 'outputs': {'id': 'result', 'property': 'children'},
+            'inputs': [{'id': 'value', 'property': 'value', 'value': value}], 'changedPropIds': ['value.value']}
+    job = client.post('/_dash-update-component', json=body).get_json()
+    for _ in range(200):
+        response = client.post(f"/_dash-update-component?cacheKey={job['cacheKey']}&job={job['job']}", json=body)
+        if response.status_code == 200 and 'response' in json.loads(response.get_data()):
+            return json.loads(response.get_data())['response']
+        time.sleep(0.05)
+    raise TimeoutError('the background job did not finish')
+
+
+def test_background_job_timings(app):
+    client = app.server.test_client()
+    assert run_background_callback(client, 'a') == {'result': {'children': 'a'}}
+    metrics = client.get('/metrics').get_data(as_text=True)
+
+    callback = 'result.children'
+    assert sample(metrics, 'dash_background_jobs_total', callback=callback, status='ok') == 1
+    assert sample(metrics, 'dash_background_job_duration_seconds_count', callback=callback, phase='db') == 1
+    assert sample(metrics, 'dash_background_job_duration_seconds_count', callback=callback, phase='compute') == 1
+    assert sample(metrics, 'dash_background_job_duration_seconds_sum', callback=callback, phase='db') == 0.2
+    assert sample(metrics, 'dash_background_job_duration_seconds_sum', callback=callback, phase='compute') >= 0.1
+    # The requests are counted apart, and not as the duration of the callback
+    requests = 'dash_background_request_duration_seconds_count'
+    assert sample(metrics, requests, callback=callback, request='start') == 1
+    assert sample(metrics, requests, callback=callback, request='poll') >= 1
+    assert 'dash_callback_duration_seconds_count{callback="result.children"' not in metrics
+
+    # Timings are moved to the registry once
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert sample(metrics, 'dash_background_jobs_total', callback=callback, status='ok') == 1
@@ -0,0 +1,102 @@
+from collections import Counter
+import random
+import sqlite3
+
+import pytest
+
+from graph.sampling import ItemSampler
+
+
+# MySQL connection backed by SQLite: placeholders, parenthesized members of a UNION and SHOW COLUMNS are translated
+class SQLiteConnection:
+
+    def __init__(self, items, rand_key=True):
+        self.connection = sqlite3.connect(':memory:')
+        columns = 'id TEXT PRIMARY KEY, category TEXT' + (', rand_key REAL' if rand_key else '')
+        self.connection.execute(f"CREATE TABLE items ({columns})")
+        rng = random.Random(0)
+        self.connection.executemany(f"INSERT INTO items VALUES ({'?, ?, ?' if rand_key else '?, ?'})",
+                                    [(item_id, category, rng.random())[:3 if rand_key else 2]
+                                     for item_id, category in items])
+        self.rand_key = rand_key
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self.connection.commit()
+
+
+class SQLiteCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, params=()):
+        if query.startswith('SHOW COLUMNS'):
+            self.rows = [('rand_key',)] if self.connection.rand_key else []
+            return
+        query = query.replace('%s', '?').replace('(SELECT ', 'SELECT * FROM (SELECT ')
+        self.rows = self.connection.connection.execute(query, list(params)).fetchall()
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+ITEMS = [(f'item{i}', 'books' if i % 3 else 'music') for i in range(300)]
+
+
+@pytest.mark.parametrize('rand_key', [True, False])
+def test_sample_is_distinct_and_in_categories(rand_key):
+    sampler = ItemSampler(SQLiteConnection(ITEMS, rand_key), seed=1)
+    sample = sampler.sample(['music'], 40)
+    assert len(sample) == len(set(sample)) == 40
+    assert {item for item, category in ITEMS if category == 'music'}.issuperset(sample)
+
+
+def test_sample_of_every_item():
+    sampler = ItemSampler(SQLiteConnection(ITEMS), seed=1)
+    assert sorted(sampler.sample(['books', 'music'], 1000)) == sorted(item for item, _ in ITEMS)
+
+
+def test_empty_sample():
+    sampler = ItemSampler(SQLiteConnection(ITEMS), seed=1)
+    assert sampler.sample([], 10) == []
+    assert sampler.sample(['books'], 0) == []
+    assert sampler.sample(['games'], 10) == []
+
+
+def test_samples_are_not_runs_of_keys():
+    # In runs of 10 consecutive keys, an item could only be drawn with the 9 items before it and the 9 after it
+    sampler = ItemSampler(SQLiteConnection(ITEMS), seed=1)
+    samples = [sampler.sample(['books', 'music'], 10) for _ in range(300)]
+    item, count = Counter(item for sample in samples for item in sample).most_common(1)[0]
+    together = Counter(other for sample in samples if item in sample for other in sample if other != item)
+    assert count >= 5
+    assert len(together) > 18
+
+
+def test_seek_draws_are_spread_over_the_items():
+    sampler = ItemSampler(SQLiteConnection(ITEMS), seed=1)
+    counts = Counter(item for _ in range(200) for item in sampler.sample(['books', 'music'], 10))
+    assert len(counts) > 250
+
+
+def test_add_rand_key(monkeypatch):
+    sampler = ItemSampler(SQLiteConnection(ITEMS, rand_key=False))
+    assert not sampler.has_rand_key()
+    # The statements are MySQL only, they are recorded instead
+    executed = []
+    monkeypatch.setattr(SQLiteCursor, 'execute', lambda self, query, params=(): executed.append(query))
+    sampler.add_rand_key()
+    assert executed == ["ALTER TABLE items ADD COLUMN rand_key DOUBLE NOT NULL DEFAULT 0",
+                        "UPDATE items SET rand_key = RAND()",
+                        "ALTER TABLE items ADD INDEX category_rand_key (category, rand_key)"]
+    assert sampler.has_rand_key()
@@ -0,0 +1,99 @@
+from itertools import combinations
+import random
+
+import numpy as np
+import pytest
+
+from graph.similarity import cooccurrence_pairs, incidence_matrix, jaccard_pairs, neighbour_stats, similar_pairs
+
+
+@pytest.fixture
+def reviews():
+    rng = random.Random(0)
+    return [(f'u{rng.randrange(40)}', f'i{rng.randrange(30)}') for _ in range(200)]
+
+
+# {(row, col): (shared columns, jaccard)} of every pair of rows sharing a column, row < col
+def brute_force(matrix):
+    sets = [set(matrix[row].indices) for row in range(matrix.shape[0])]
+    return {(a, b): (len(sets[a] & sets[b]), len(sets[a] & sets[b]) / len(sets[a] | sets[b]))
+            for a, b in combinations(range(len(sets)), 2) if sets[a] & sets[b]}
+
+
+def test_incidence_matrix():
+    matrix, users, items = incidence_matrix([('u1', 'i1'), ('u2', 'i1'), ('u1', 'i1'), ('u1', 'i2')])
+    assert users == ['u1', 'u2'] and items == ['i1', 'i2']
+    # Repeated pairs count once
+    np.testing.assert_array_equal(matrix.toarray(), [[1, 1], [1, 0]])
+    matrix, users, _ = incidence_matrix([('u1', 'i1'), ('u3', 'i1')], rows=['u2', 'u1'])
+    assert users == ['u2', 'u1']
+    np.testing.assert_array_equal(matrix.toarray(), [[0], [1]])
+
+
+@pytest.mark.parametrize('block_size', [4096, 7])
+def test_cooccurrence_pairs(reviews, block_size):
+    matrix = incidence_matrix(reviews)[0]
+    rows, cols, counts = cooccurrence_pairs(matrix, block_size)
+    # Upper triangle only: each pair once, with rows < cols
+    assert (rows < cols).all()
+    assert len(set(zip(rows.tolist(), cols.tolist()))) == len(rows)
+    assert dict(zip(zip(rows.tolist(), cols.tolist()), counts.tolist())) == \
+           {pair: shared for pair, (shared, _) in brute_force(matrix).items()}
+
+
+def test_jaccard_pairs(reviews):
+    matrix = incidence_matrix(reviews)[0]
+    rows, cols, jaccard = jaccard_pairs(matrix, block_size=5)
+    assert (rows < cols).all()
+    expected = {pair: score for pair, (_, score) in brute_force(matrix).items()}
+    assert set(zip(rows.tolist(), cols.tolist())) == set(expected)
+    for row, col, score in zip(rows, cols, jaccard):
+        assert score == pytest.approx(expected[row, col])
+    rows, cols, jaccard = jaccard_pairs(matrix, min_jaccard=0.2)
+    assert (jaccard > 0.2).all()
+    assert len(rows) == sum(score > 0.2 for score in expected.values())
+
+
+def test_minhash_pairs_are_exact_scores_of_a_subset(reviews):
+    matrix = incidence_matrix(reviews)[0]
+    expected = {pair: score for pair, (_, score) in brute_force(matrix).items()}
+    rows, cols, jaccard = similar_pairs(matrix, method='minhash', seed=1)
+    assert (rows < cols).all()
+    for row, col, score in zip(rows, cols, jaccard):
+        assert score == pytest.approx(expected[row, col])
+    # Identical rows always collide
+    duplicated = incidence_matrix([('a', 'i1'), ('a', 'i2'), ('b', 'i1'), ('b', 'i2'), ('c', 'i3')])[0]
+    rows, cols, jaccard = similar_pairs(duplicated, method='minhash')
+    assert list(zip(rows, cols, jaccard)) == [(0, 1, 1.0)]
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        similar_pairs(incidence_matrix([('u1', 'i1')])[0], method='cosine')
+
+
+@pytest.mark.parametrize('pairs', [[], [('u1', 'i1')], [('u1', 'i1'), ('u2', 'i2')]])
+@pytest.mark.parametrize('method', ['exact', 'minhash'])
+def test_no_similar_pairs(pairs, method):
+    matrix = incidence_matrix(pairs)[0]
+    assert all(len(array) == 0 for array in cooccurrence_pairs(matrix))
+    assert all(len(array) == 0 for array in similar_pairs(matrix, method=method))
+
+
+def test_neighbour_stats():
+    rows, cols, scores = np.array([0, 0, 1, 2]), np.array([1, 2, 2, 3]), np.array([0.5, 0.9, 0.2, 0.4])
+    counts, neighbours, similarities = neighbour_stats(5, rows, cols, scores, k=2)
+    np.testing.assert_array_equal(counts, [2, 2, 3, 1, 0])
+    # Pairs are neighbours of both of their rows, most similar first
+    np.testing.assert_array_equal(neighbours[0], [2, 1])
+    np.testing.assert_array_equal(neighbours[2], [0, 3])
+    np.testing.assert_array_equal(similarities[2], [0.9, 0.4])
+    np.testing.assert_array_equal(neighbours[3], [2])
+    assert len(neighbours[4]) == len(similarities[4]) == 0
+
+
+def test_neighbour_stats_without_pairs():
+    empty = np.empty(0, dtype=np.int64)
+    counts, neighbours, similarities = neighbour_stats(3, empty, empty, np.empty(0))
+    np.testing.assert_array_equal(counts, [0, 0, 0])
+    assert all(len(top) == 0 for top in neighbours + similarities)
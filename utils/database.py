@@ -1,9 +1,11 @@
 import pymongo
 import mysql.connector
+import mysql.connector.pooling
 import neo4j
 
 import configparser
-from typing import Dict
+import os
+from typing import Dict, Tuple
 
 # Extract MongoClient parameters from `config.ini` file
 config = configparser.ConfigParser()
@@ -31,18 +33,25 @@ NEO4J_PASSWORD = config['Neo4j']['password']
 __all__ = [
     'connect_to_mongodb',
     'connect_to_mysql',
+    'connect_to_mysql_pool',
+    'connect_to_neo4j',
+    'connect_to_neo4j_async',
     'create_database_mysql',
     'create_database_mongodb'
 ]
 mongo_client: pymongo.MongoClient = None
+mongo_client_pid: int = None
 mysql_conn: mysql.connector.MySQLConnection = None
 neo4j_driver: neo4j.Driver = None
+mysql_pools: Dict[Tuple[str, int], mysql.connector.pooling.MySQLConnectionPool] = {}
 
 
 def connect_to_mongodb() -> pymongo.MongoClient:
-    global mongo_client
-    if not mongo_client:
+    global mongo_client, mongo_client_pid
+    # Clients can't be shared with forked processes (e.g. WSGI workers), each process opens its own
+    if not mongo_client or mongo_client_pid != os.getpid():
         mongo_client = pymongo.MongoClient(MONGO_URI)
+        mongo_client_pid = os.getpid()
     return mongo_client
 
 
@@ -55,6 +64,19 @@ def connect_to_mysql() -> mysql.connector.MySQLConnection:
     return mysql_conn
 
 
+def connect_to_mysql_pool(database: str, pool_size: int = 5) -> mysql.connector.pooling.MySQLConnectionPool:
+    # Pools are shared per database and process. Unlike the single connection, they can be used from several threads
+    key = (database, os.getpid())
+    if key not in mysql_pools:
+        mysql_pools[key] = mysql.connector.pooling.MySQLConnectionPool(pool_name=f'{database}_{key[1]}_pool',
+                                                                       pool_size=pool_size,
+                                                                       host=MYSQL_HOST,
+                                                                       user=MYSQL_USER,
+                                                                       password=MYSQL_PASSWORD,
+                                                                       database=database)
+    return mysql_pools[key]
+
+
 def connect_to_neo4j() -> neo4j.Driver:
     global neo4j_driver
     if not neo4j_driver:
@@ -64,6 +86,11 @@ def connect_to_neo4j() -> neo4j.Driver:
     return neo4j_driver
 
 
+def connect_to_neo4j_async(**driver_config) -> neo4j.AsyncDriver:
+    # Async drivers belong to the event loop they are used in, so a new one is returned on every call
+    return neo4j.AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), **driver_config)
+
+
 class NoClientConnected(Exception):
     def __init__(self, message="No client was connected. Please connect to your client first before creating a "
                                "database."):
@@ -129,9 +156,12 @@ def create_database_mysql(name: str, user_details: Dict[int, int], item_details:
     user_columns = ', '.join([f"{col} {dtype}" for col, dtype in user_details.items()])
     cursor.execute(f"CREATE TABLE IF NOT EXISTS users (id VARCHAR(255) PRIMARY KEY, {user_columns})")
 
-    # Create items table
+    # Create items table. Each item has a random key, uniform in [0, 1), so random samples are index range seeks
     item_columns = ', '.join([f"{col} {dtype}" for col, dtype in item_details.items()])
-    cursor.execute(f"CREATE TABLE IF NOT EXISTS items (id VARCHAR(255) PRIMARY KEY, {item_columns})")
+    rand_key_index = 'INDEX category_rand_key (category, rand_key)' if 'category' in item_details \
+        else 'INDEX rand_key (rand_key)'
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS items (id VARCHAR(255) PRIMARY KEY, {item_columns}, "
+                   f"rand_key DOUBLE NOT NULL, {rand_key_index})")
     return name
 
 
@@ -1,11 +1,15 @@
 from utils.database import connect_to_mysql, connect_to_mongodb, create_database_mysql,\
     create_database_mongodb
-from concurrent.futures import ThreadPoolExecutor
+from utils.metadata import TERM_FREQUENCIES_COLLECTION, write_dataset_version, write_dataset_counts, \
+    write_category_stats
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from threading import Lock, Event
+from wordcloud import WordCloud
 
 import uuid
 import json
 import os
+import random
 
 from datetime import datetime as dt
 from typing import Dict, Tuple
@@ -248,10 +252,10 @@ def _save_data(users, items, reviews, mysql_db_name='amz_reviews', mongo_db_name
         user_values = [tuple(user.values()) for user in users]
         cursor.executemany(f"INSERT INTO users ({user_columns}) VALUES ({user_values_template})", user_values)
 
-        # Insert items data into items table
-        item_columns = ', '.join(['id'] + list(item_details))
-        item_values_template = ', '.join(['%s'] * (len(item_details) + 1))
-        item_values = [tuple(item.values()) for item in items]
+        # Insert items data into items table, with the random keys used to sample them
+        item_columns = ', '.join(['id'] + list(item_details) + ['rand_key'])
+        item_values_template = ', '.join(['%s'] * (len(item_details) + 2))
+        item_values = [tuple(item.values()) + (random.random(),) for item in items]
         cursor.executemany(f"INSERT INTO items ({item_columns}) VALUES ({item_values_template})", item_values)
 
         # Commit new insertions
@@ -271,12 +275,66 @@ def _save_data(users, items, reviews, mysql_db_name='amz_reviews', mongo_db_name
         future = executor.submit(animate, stop_event, f'Saving reviews in {mongo_db_name} (MongoDB)')
         # Insert reviews data into reviews collection
         reviews_col.insert_many(reviews)
+        # Indexes used by the dashboard: date range queries and lookups of users and items
+        reviews_col.create_index([('category', 1), ('reviewTime', 1)])
+        reviews_col.create_index('reviewer_id')
+        reviews_col.create_index('item_id')
         # Stop spinning wheel animation
         stop_event.set()
     print(f"\rCompleted saving reviews in {mongo_db_name} (MongoDB)")
     return mysql_db_name, mongo_db_name
 
 
+# Number of terms kept in the term frequency table of each category
+MAX_TERMS_PER_CATEGORY = 1000
+
+
+# Tokenize the summaries of a category the same way `WordCloud.generate` does and keep the most frequent terms
+def _count_terms(summaries):
+    frequencies = WordCloud(min_word_length=3).process_text(' '.join(summaries))
+    return sorted(frequencies.items(), key=lambda term: term[1], reverse=True)[:MAX_TERMS_PER_CATEGORY]
+
+
+# Save the term frequency table of every category, used to render the word clouds of the dashboard
+def _save_term_frequencies(reviews, mongo_db_name='amz_reviews', workers=4):
+    summaries = {}
+    for review in reviews:
+        if review.get('category') is not None:
+            summaries.setdefault(review['category'], []).append(review.get('summary') or '')
+    categories = list(summaries)
+
+    with ThreadPoolExecutor() as executor:
+        stop_event = Event()
+        future = executor.submit(animate, stop_event, f'Saving term frequencies in {mongo_db_name} (MongoDB)')
+        # Tokenize each category once, in parallel
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frequencies = list(pool.map(_count_terms, [summaries[category] for category in categories]))
+
+        term_frequencies_col = MONGO_CLIENT[mongo_db_name][TERM_FREQUENCIES_COLLECTION]
+        term_frequencies_col.delete_many({})
+        if categories:
+            term_frequencies_col.insert_many([{'_id': category, 'frequencies': [list(term) for term in terms]}
+                                              for category, terms in zip(categories, frequencies)])
+        # Stop spinning wheel animation
+        stop_event.set()
+    print(f"\rCompleted saving term frequencies in {mongo_db_name} (MongoDB)")
+
+
+# Number of reviews and first and last review time of every category
+def _get_category_stats(reviews):
+    category_stats = {}
+    for review in reviews:
+        category, review_time = review.get('category'), review.get('reviewTime')
+        if category is None:
+            continue
+        stats = category_stats.setdefault(category, {'count': 0, 'min_date': None, 'max_date': None})
+        stats['count'] += 1
+        if review_time is not None:
+            stats['min_date'] = review_time if stats['min_date'] is None else min(stats['min_date'], review_time)
+            stats['max_date'] = review_time if stats['max_date'] is None else max(stats['max_date'], review_time)
+    return category_stats
+
+
 # Worker Thread function
 def _worker(reviews, user_details=('reviewerID', 'reviewerName'),
             item_details=('asin', 'category'),
@@ -333,4 +391,10 @@ def etl(path_to_files: str = 'data', user_details: Dict[str, str] = None, item_d
         mysql_db_name, mongo_db_name = _save_data(users=users_list, items=items_list, reviews=reviews_list,
                                                   mysql_db_name=mysql_db_name, mongo_db_name=mongo_db_name,
                                                   user_details=user_details, item_details=item_details)
+        _save_term_frequencies(reviews_list, mongo_db_name=mongo_db_name, workers=workers)
+        write_dataset_counts(MONGO_CLIENT[mongo_db_name], users=len(users_list), items=len(items_list),
+                             reviews=len(reviews_list))
+        write_category_stats(MONGO_CLIENT[mongo_db_name], _get_category_stats(reviews_list))
+        # Stamp the new data, so anything cached from a previous load is invalidated
+        write_dataset_version(MONGO_CLIENT[mongo_db_name])
     return mysql_db_name, mongo_db_name
@@ -0,0 +1,115 @@
+import pymongo.database
+
+from datetime import datetime
+from typing import Dict
+import uuid
+
+__all__ = [
+    'METADATA_COLLECTION',
+    'TERM_FREQUENCIES_COLLECTION',
+    'write_dataset_version',
+    'get_dataset_version',
+    'write_dataset_counts',
+    'get_dataset_counts',
+    'write_category_stats',
+    'get_category_stats'
+]
+
+# Collections written by the ETL next to the "reviews" collection
+METADATA_COLLECTION = 'metadata'
+TERM_FREQUENCIES_COLLECTION = 'term_frequencies'
+
+# Identifier of the document holding the dataset wide metadata
+DATASET_DOCUMENT = 'dataset'
+
+
+def write_dataset_version(database: pymongo.database.Database) -> str:
+    """
+    Stamp the dataset with a new version. Anything derived from the data (cached figures, images...) must be keyed on
+    this version, so it is invalidated whenever the ETL (re)loads the database.
+
+    Parameters:
+        database (Database): The MongoDB database holding the reviews.
+
+    Returns:
+        str: The new dataset version.
+    """
+    version = uuid.uuid4().hex
+    database[METADATA_COLLECTION].update_one(
+        {'_id': DATASET_DOCUMENT},
+        {'$set': {'version': version, 'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+    return version
+
+
+def get_dataset_version(database: pymongo.database.Database) -> str:
+    """
+    Get the current dataset version, or None if the database was loaded before versions were written.
+
+    Parameters:
+        database (Database): The MongoDB database holding the reviews.
+    """
+    document = database[METADATA_COLLECTION].find_one({'_id': DATASET_DOCUMENT}, {'version': 1})
+    return document.get('version') if document else None
+
+
+def write_dataset_counts(database: pymongo.database.Database, users: int, items: int, reviews: int):
+    """
+    Store the number of users, items and reviews of the dataset.
+
+    Parameters:
+        database (Database): The MongoDB database holding the reviews.
+        users (int): Number of users.
+        items (int): Number of items.
+        reviews (int): Number of reviews.
+    """
+    database[METADATA_COLLECTION].update_one(
+        {'_id': DATASET_DOCUMENT},
+        {'$set': {'counts': {'users': users, 'items': items, 'reviews': reviews}}},
+        upsert=True
+    )
+
+
+def get_dataset_counts(database: pymongo.database.Database) -> dict:
+    """
+    Get the stored number of users, items and reviews, or None if they were never written.
+
+    Parameters:
+        database (Database): The MongoDB database holding the reviews.
+    """
+    document = database[METADATA_COLLECTION].find_one({'_id': DATASET_DOCUMENT}, {'counts': 1})
+    return document.get('counts') if document else None
+
+
+def write_category_stats(database: pymongo.database.Database, category_stats: Dict[str, dict]):
+    """
+    Store the number of reviews and the first and last review time of every category.
+
+    Parameters:
+        database (Database): The MongoDB database holding the reviews.
+        category_stats (dict): {category: {'count': int, 'min_date': datetime, 'max_date': datetime}}
+    """
+    database[METADATA_COLLECTION].update_one(
+        {'_id': DATASET_DOCUMENT},
+        # Stored as a list, category names are not valid as field names
+        {'$set': {'categories': [{'name': name, **stats} for name, stats in category_stats.items()]}},
+        upsert=True
+    )
+
+
+def get_category_stats(database: pymongo.database.Database) -> Dict[str, dict]:
+    """
+    Get the stored stats of every category, or None if they were never written.
+
+    Parameters:
+        database (Database): The MongoDB database holding the reviews.
+
+    Returns:
+        dict: {category: {'count': int, 'min_date': datetime, 'max_date': datetime}}
+    """
+    document = database[METADATA_COLLECTION].find_one({'_id': DATASET_DOCUMENT}, {'categories': 1})
+    if not document or 'categories' not in document:
+        return None
+    return {stats['name']: {key: value for key, value in stats.items() if key != 'name'}
+            for stats in document['categories']}
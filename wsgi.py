@@ -0,0 +1,9 @@
+from app.dash_app import create_app
+
+import os
+
+# WSGI entry point, e.g. `gunicorn --workers 4 --threads 8 wsgi:server`
+# The databases are the ones created by the ETL, override them with the MYSQL_DB_NAME and MONGO_DB_NAME variables
+app = create_app(mysql_db_name=os.environ.get('MYSQL_DB_NAME', 'amz_reviews'),
+                 mongo_db_name=os.environ.get('MONGO_DB_NAME', 'amz_reviews'))
+server = app.server